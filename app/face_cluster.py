@@ -1,154 +1,360 @@
 import numpy as np
 import os
-import base64
-from typing import List, Dict, Any
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from sklearn.cluster import DBSCAN
-from collections import defaultdict
 import random
 from PIL import Image
 import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .hashing import hash64
 
-# Store face data with image references
-FACE_DATABASE = []  # List of dicts: {cluster_id, encoding, image_path, thumbnail}
+try:
+    import faiss  # Optional: SIMD-optimized exact nearest-neighbour search
+except ImportError:
+    faiss = None
+
+try:
+    from numba import njit  # Optional: compiled distance kernel when FAISS is unavailable
+except ImportError:
+    njit = None
+
+# Faces are stored column-wise: row i of the encoding store and of _CLUSTER_IDS describe the
+# same face as _FACE_META[i], which only holds the small per-face metadata
+_FACE_META = []  # List of dicts: {image_path, thumbnail}
 NEXT_CLUSTER_ID = 1
 
-def create_thumbnail(image_path: str, size: tuple = (150, 150)) -> str:
-    """Creates a base64 encoded thumbnail of an image."""
+# Scans cluster faces on a background task while /api/faces reads the store, so every
+# mutation and every read of the face store below holds this lock
+_FACE_LOCK = threading.Lock()
+
+# First rows of each cluster in insertion order (row 0 is the representative face),
+# maintained on insert so summaries never rescan every face
+CLUSTER_SAMPLE_SIZE = 3
+_CLUSTER_SAMPLE_ROWS: Dict[int, List[int]] = {}
+
+FACE_ENCODING_DIM = 128
+FACE_ENCODING_DTYPE = np.float16  # Storage precision for encodings; matching runs in float32
+FACE_MATCH_THRESHOLD = 50  # Mock threshold (Euclidean distance)
+
+_RNG = np.random.default_rng()  # Source of mock encodings
+
+# Known encodings as one contiguous FACE_ENCODING_DTYPE matrix (rows parallel to _FACE_META),
+# so a new face is compared against all of them in a few vectorized operations.
+# Capacity doubles when full to keep appends amortized O(1).
+_KNOWN_MATRIX = np.empty((0, FACE_ENCODING_DIM), dtype=FACE_ENCODING_DTYPE)
+_CLUSTER_IDS = np.empty(0, dtype=np.int64)
+_KNOWN_SQNORMS = np.empty(0, dtype=np.float32)  # Cached ||row||^2 for the BLAS fallback
+_KNOWN_COUNT = 0
+MATCH_BLOCK_ROWS = 4096  # Known rows upcast to float32 at a time while matching
+
+# When FAISS is installed the encodings live in its flat L2 index instead of _KNOWN_MATRIX.
+# Encodings are already float16, so an fp16 scalar-quantized index halves its memory without
+# losing precision (and needs no training).
+_FAISS_INDEX = faiss.IndexScalarQuantizer(
+    FACE_ENCODING_DIM, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2
+) if faiss is not None else None
+
+THUMBNAIL_WORKERS = os.cpu_count() or 1
+_THUMBNAIL_EXECUTOR = None  # Created on first batch and reused for the life of the process
+
+# Thumbnails are cached as JPEG files named after a hash of (path, mtime, size), so unchanged
+# images are never re-encoded and records only carry the 16-hex-digit thumbnail id
+THUMBNAIL_CACHE_DIR = os.getenv(
+    "THUMBNAIL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "smartfolder", "thumbs")
+)
+_THUMB_ID_RE = re.compile(r'^[0-9a-f]{16}$')
+_THUMB_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+# Formats we index as images; passing them to Image.open skips probing every other plugin
+THUMBNAIL_FORMATS = ['JPEG', 'PNG', 'GIF', 'BMP', 'TIFF', 'WEBP']
+
+def make_thumbnail(image_path: str, size: tuple = (150, 150)) -> Tuple[bool, Optional[str]]:
+    """Returns (is a readable image, cached thumbnail id), creating the thumbnail file if needed.
+
+    The id is None when the image can't be decoded or the cache can't be written; only the
+    former makes the image invalid.
+    """
     try:
-        with Image.open(image_path) as img:
-            img.thumbnail(size)
+        stat = os.stat(image_path)
+        thumb_id = f"{hash64(f'{image_path}:{stat.st_mtime_ns}:{stat.st_size}'):016x}"
+        thumb_path = os.path.join(THUMBNAIL_CACHE_DIR, f"{thumb_id}.jpg")
+        if os.path.exists(thumb_path):
+            return True, thumb_id
+        
+        with Image.open(image_path, formats=THUMBNAIL_FORMATS) as img:
+            # Let libjpeg decode JPEGs at a reduced scale (1/2..1/8) instead of full size
+            img.draft('RGB', (size[0] * 2, size[1] * 2))
+            # Bilinear is SIMD-accelerated under Pillow-SIMD and plenty for 150px previews
+            img.thumbnail(size, resample=Image.BILINEAR)
             # Convert to RGB if necessary
             if img.mode in ('RGBA', 'P'):
                 img = img.convert('RGB')
             
-            # Save to bytes
+            # Encode in memory so the file is written with unbuffered writes straight from it
             img_buffer = io.BytesIO()
-            img.save(img_buffer, format='JPEG', quality=85)
-            img_buffer.seek(0)
-            
-            # Encode to base64
-            img_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-            return f"data:image/jpeg;base64,{img_base64}"
+            img.save(img_buffer, format='JPEG', quality=85, optimize=False, progressive=False)
     except Exception as e:
         print(f"Error creating thumbnail for {image_path}: {e}")
+        return False, None
+    
+    try:
+        # Write under a temporary name so concurrent workers never serve a partial file
+        os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, _THUMB_OPEN_FLAGS, 0o644)
+        try:
+            # os.write may write less than asked; a short write must not leave a truncated JPEG
+            data = img_buffer.getbuffer()
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, thumb_path)
+        return True, thumb_id
+    except Exception as e:
+        # The image itself is fine; it just has no cached thumbnail
+        print(f"Error writing thumbnail for {image_path}: {e}")
+        return True, None
+
+def create_thumbnail(image_path: str, size: tuple = (150, 150)) -> Optional[str]:
+    """Returns the cached thumbnail id for an image, creating the file if needed (None on failure)."""
+    return make_thumbnail(image_path, size)[1]
+
+def get_thumbnail_path(thumb_id: str):
+    """Resolves a thumbnail id from a face record to its cached file (None if invalid)."""
+    if not _THUMB_ID_RE.match(thumb_id):
         return None
+    thumb_path = os.path.join(THUMBNAIL_CACHE_DIR, f"{thumb_id}.jpg")
+    return thumb_path if os.path.exists(thumb_path) else None
+
+def thumbnail_url(thumb_id: str):
+    """Returns the URL the frontend loads a cached thumbnail from."""
+    return f"/api/thumbnails/{thumb_id}.jpg" if thumb_id else None
 
-def detect_and_encode_faces(image_path: str) -> List[Dict[str, Any]]:
+def thumbnail_batch(image_paths: List[str]) -> Dict[str, Tuple[bool, Optional[str]]]:
+    """Runs make_thumbnail for many images in parallel worker processes, keyed by path."""
+    global _THUMBNAIL_EXECUTOR
+    
+    if len(image_paths) < 2 or THUMBNAIL_WORKERS < 2:
+        return {path: make_thumbnail(path) for path in image_paths}
+    
+    if _THUMBNAIL_EXECUTOR is None:
+        # Scans run on a threadpool, and forking a multi-threaded process can copy a held lock
+        # into the child; workers start from a clean forkserver (spawn where unavailable)
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _THUMBNAIL_EXECUTOR = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context(start_method)
+        )
+    
+    # Chunk to cut IPC overhead, but keep every worker busy on small folders
+    chunksize = max(1, min(16, len(image_paths) // THUMBNAIL_WORKERS))
+    thumbnails = _THUMBNAIL_EXECUTOR.map(make_thumbnail, image_paths, chunksize=chunksize)
+    return dict(zip(image_paths, thumbnails))
+
+def detect_and_encode_faces(image_path: str,
+                            thumbnail: Optional[Tuple[bool, Optional[str]]] = None) -> List[Dict[str, Any]]:
     """
     Enhanced: Detects faces in an image and returns face data with metadata.
     In a real app, this would use face_recognition or similar library.
+    The image's make_thumbnail() result, as from thumbnail_batch(), can be passed in to skip
+    decoding here.
     """
     if not os.path.exists(image_path):
         return []
     
-    # Check if it's actually an image file
-    try:
-        with Image.open(image_path) as img:
-            pass  # Just verify it's a valid image
-    except:
-        return []
-    
     # Simulate face detection (30% chance of finding 1-2 faces in images)
     if random.random() > 0.7:
         return []
     
+    # A single decode serves every face in the image and doubles as the validity check;
+    # faces are still returned, without a thumbnail, when only the cache write failed
+    valid, thumbnail = thumbnail if thumbnail is not None else make_thumbnail(image_path)
+    if not valid:
+        return []
+    
     num_faces = random.randint(1, 2)
     faces_data = []
     
     for _ in range(num_faces):
-        # Generate mock 128-dimension encoding
-        encoding = [random.uniform(-1, 1) for _ in range(128)]
+        # Generate mock 128-dimension encoding, stored at half precision
+        encoding = _RNG.uniform(-1.0, 1.0, size=FACE_ENCODING_DIM).astype(FACE_ENCODING_DTYPE)
         
         face_data = {
             'encoding': encoding,
             'image_path': image_path,
-            'thumbnail': create_thumbnail(image_path)
+            'thumbnail': thumbnail
         }
         faces_data.append(face_data)
     
     return faces_data
 
+if njit is not None:
+    @njit('Tuple((i8, f4))(f4[:, ::1], f4[::1])', fastmath=True, cache=True, boundscheck=False)
+    def _nearest_sq_l2(known, encoding):
+        """Returns (row, squared distance) of the known encoding nearest to `encoding`."""
+        best_row = -1
+        best_sq_dist = np.float32(3.4e38)
+        for row in range(known.shape[0]):
+            sq_dist = np.float32(0.0)
+            # Fixed trip count lets LLVM fully unroll and vectorize the inner loop
+            for k in range(FACE_ENCODING_DIM):
+                d = known[row, k] - encoding[k]
+                sq_dist += d * d
+            if sq_dist < best_sq_dist:
+                best_sq_dist = sq_dist
+                best_row = row
+        return best_row, best_sq_dist
+else:
+    _nearest_sq_l2 = None
+
+def _append_known_face(encoding: np.ndarray, cluster_id: int):
+    """Appends an encoding and its cluster id to the known-face store."""
+    global _KNOWN_MATRIX, _CLUSTER_IDS, _KNOWN_SQNORMS, _KNOWN_COUNT
+
+    if _KNOWN_COUNT == len(_CLUSTER_IDS):
+        capacity = max(64, 2 * len(_CLUSTER_IDS))
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:_KNOWN_COUNT] = _CLUSTER_IDS[:_KNOWN_COUNT]
+        _CLUSTER_IDS = ids
+        if _FAISS_INDEX is None:
+            matrix = np.empty((capacity, FACE_ENCODING_DIM), dtype=FACE_ENCODING_DTYPE)
+            matrix[:_KNOWN_COUNT] = _KNOWN_MATRIX[:_KNOWN_COUNT]
+            sqnorms = np.empty(capacity, dtype=np.float32)
+            sqnorms[:_KNOWN_COUNT] = _KNOWN_SQNORMS[:_KNOWN_COUNT]
+            _KNOWN_MATRIX, _KNOWN_SQNORMS = matrix, sqnorms
+
+    # FAISS row ids are assigned sequentially, so they stay aligned with _CLUSTER_IDS
+    if _FAISS_INDEX is not None:
+        _FAISS_INDEX.add(encoding.reshape(1, -1))
+    else:
+        _KNOWN_MATRIX[_KNOWN_COUNT] = encoding
+        # Norm of the stored (rounded) row, so the GEMV expansion matches what is compared
+        stored = _KNOWN_MATRIX[_KNOWN_COUNT].astype(np.float32)
+        _KNOWN_SQNORMS[_KNOWN_COUNT] = stored @ stored
+    _CLUSTER_IDS[_KNOWN_COUNT] = cluster_id
+    _KNOWN_COUNT += 1
+
+def _find_matching_cluster(encoding: np.ndarray):
+    """Returns the cluster id of the nearest known face within the threshold, or None."""
+    if _KNOWN_COUNT == 0:
+        return None
+
+    if _FAISS_INDEX is not None:
+        sq_dists, rows = _FAISS_INDEX.search(encoding.reshape(1, -1), 1)
+        best_sq_dist, idx = sq_dists[0, 0], int(rows[0, 0])
+    else:
+        # Rows are stored in FACE_ENCODING_DTYPE; upcast one block at a time so matching
+        # runs in float32 without a full-size float32 copy of the store
+        idx, best_sq_dist = -1, np.inf
+        encoding_sqnorm = encoding @ encoding
+        for start in range(0, _KNOWN_COUNT, MATCH_BLOCK_ROWS):
+            stop = min(start + MATCH_BLOCK_ROWS, _KNOWN_COUNT)
+            known = _KNOWN_MATRIX[start:stop].astype(np.float32)
+            if _nearest_sq_l2 is not None:
+                row, sq_dist = _nearest_sq_l2(known, encoding)
+            else:
+                # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2: one BLAS GEMV, no (N, 128) difference
+                sq_dists = _KNOWN_SQNORMS[start:stop] - 2.0 * (known @ encoding) + encoding_sqnorm
+                row = int(sq_dists.argmin())
+                sq_dist = sq_dists[row]
+            if sq_dist < best_sq_dist:
+                idx, best_sq_dist = start + int(row), sq_dist
+
+    # Both paths yield squared distances, so compare against the squared threshold
+    if best_sq_dist < FACE_MATCH_THRESHOLD ** 2:
+        return int(_CLUSTER_IDS[idx])
+    return None
+
 def cluster_faces(faces_data: List[Dict[str, Any]]) -> List[int]:
     """
     Enhanced: Clusters face encodings and stores them with image references.
     """
-    global FACE_DATABASE, NEXT_CLUSTER_ID
+    global NEXT_CLUSTER_ID
     
     if not faces_data:
         return []
     
     assigned_cluster_ids = []
     
-    for face_data in faces_data:
-        encoding = face_data['encoding']
-        
-        # Simple similarity check with existing faces
-        cluster_id = None
-        
-        # Check against existing faces (simplified clustering)
-        for existing_face in FACE_DATABASE:
-            # Calculate similarity (mock distance calculation)
-            distance = sum((a - b) ** 2 for a, b in zip(encoding, existing_face['encoding'])) ** 0.5
+    # Matching and storing happen under one hold, so readers never see a half-added face
+    with _FACE_LOCK:
+        for face_data in faces_data:
+            # Match in float32; _append_known_face rounds it to FACE_ENCODING_DTYPE for storage
+            encoding = np.ascontiguousarray(face_data['encoding'], dtype=np.float32)
             
-            # If similar enough (threshold), assign to same cluster
-            if distance < 50:  # Mock threshold
-                cluster_id = existing_face['cluster_id']
-                break
-        
-        # If no similar face found, create new cluster
-        if cluster_id is None:
-            cluster_id = NEXT_CLUSTER_ID
-            NEXT_CLUSTER_ID += 1
-        
-        # Add to database
-        face_record = {
-            'cluster_id': cluster_id,
-            'encoding': encoding,
-            'image_path': face_data['image_path'],
-            'thumbnail': face_data['thumbnail']
-        }
-        FACE_DATABASE.append(face_record)
-        assigned_cluster_ids.append(cluster_id)
+            # Check against all existing faces at once (simplified clustering)
+            cluster_id = _find_matching_cluster(encoding)
+            
+            # If no similar face found, create new cluster
+            if cluster_id is None:
+                cluster_id = NEXT_CLUSTER_ID
+                NEXT_CLUSTER_ID += 1
+            
+            # Add to database
+            sample_rows = _CLUSTER_SAMPLE_ROWS.setdefault(cluster_id, [])
+            if len(sample_rows) < CLUSTER_SAMPLE_SIZE:
+                sample_rows.append(len(_FACE_META))
+            _FACE_META.append({
+                'image_path': face_data['image_path'],
+                'thumbnail': face_data['thumbnail']
+            })
+            _append_known_face(encoding, cluster_id)
+            assigned_cluster_ids.append(cluster_id)
     
     return assigned_cluster_ids
 
 def get_face_clusters_summary() -> List[Dict[str, Any]]:
     """Enhanced: Returns face clusters with representative thumbnails."""
-    cluster_data = defaultdict(list)
-    
-    # Group faces by cluster_id
-    for face in FACE_DATABASE:
-        cluster_data[face['cluster_id']].append(face)
-    
     summary = []
-    for cluster_id, faces in cluster_data.items():
-        # Use first face as representative thumbnail
-        representative_face = faces[0]
+    with _FACE_LOCK:
+        # Face counts for every cluster id in one pass over the id column
+        counts = np.bincount(_CLUSTER_IDS[:_KNOWN_COUNT], minlength=NEXT_CLUSTER_ID)
         
-        cluster_info = {
-            "cluster_id": cluster_id,
-            "name": f"Person {cluster_id}",
-            "count": len(faces),
-            "thumbnail": representative_face['thumbnail'],
-            "sample_images": [face['image_path'] for face in faces[:3]]  # Up to 3 sample images
-        }
-        summary.append(cluster_info)
+        for cluster_id, sample_rows in _CLUSTER_SAMPLE_ROWS.items():
+            # Use first face as representative thumbnail
+            representative_face = _FACE_META[sample_rows[0]]
+            
+            cluster_info = {
+                "cluster_id": cluster_id,
+                "name": f"Person {cluster_id}",
+                "count": int(counts[cluster_id]),
+                "thumbnail": thumbnail_url(representative_face['thumbnail']),
+                "sample_images": [_FACE_META[row]['image_path'] for row in sample_rows]  # Up to 3 sample images
+            }
+            summary.append(cluster_info)
     
     return summary
 
+def get_face_cluster_count() -> int:
+    """Returns the number of face clusters without building the summary."""
+    with _FACE_LOCK:
+        return len(_CLUSTER_SAMPLE_ROWS)
+
 def get_images_for_cluster(cluster_id: int) -> List[Dict[str, Any]]:
     """Get all images for a specific face cluster."""
-    cluster_images = []
-    for face in FACE_DATABASE:
-        if face['cluster_id'] == cluster_id:
-            cluster_images.append({
-                'path': face['image_path'],
-                'thumbnail': face['thumbnail']
-            })
-    return cluster_images
+    with _FACE_LOCK:
+        rows = np.flatnonzero(_CLUSTER_IDS[:_KNOWN_COUNT] == cluster_id)
+        return [
+            {
+                'path': _FACE_META[row]['image_path'],
+                'thumbnail': thumbnail_url(_FACE_META[row]['thumbnail'])
+            }
+            for row in rows
+        ]
 
 def clear_face_database():
     """Clear all face data (useful for testing)."""
-    global FACE_DATABASE, NEXT_CLUSTER_ID
-    FACE_DATABASE = []
-    NEXT_CLUSTER_ID = 1
\ No newline at end of file
+    global _FACE_META, NEXT_CLUSTER_ID, _KNOWN_MATRIX, _CLUSTER_IDS, _KNOWN_SQNORMS, _KNOWN_COUNT
+    with _FACE_LOCK:
+        _FACE_META = []
+        NEXT_CLUSTER_ID = 1
+        _CLUSTER_SAMPLE_ROWS.clear()
+        _KNOWN_MATRIX = np.empty((0, FACE_ENCODING_DIM), dtype=FACE_ENCODING_DTYPE)
+        _CLUSTER_IDS = np.empty(0, dtype=np.int64)
+        _KNOWN_SQNORMS = np.empty(0, dtype=np.float32)
+        _KNOWN_COUNT = 0
+        if _FAISS_INDEX is not None:
+            _FAISS_INDEX.reset()
\ No newline at end of file
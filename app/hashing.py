@@ -0,0 +1,13 @@
+import hashlib
+
+try:
+    import xxhash  # Optional: several times faster than hashlib for short keys
+except ImportError:
+    xxhash = None
+
+def hash64(text: str) -> int:
+    """Returns a stable unsigned 64-bit hash of a string (unlike hash(), not salted per process)."""
+    data = text.encode('utf-8')
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(data)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
@@ -0,0 +1,184 @@
+import json
+import sqlite3
+import sys
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+# Scanned file records live in SQLite so stats and lookups run as queries, not Python loops
+INDEX_DB_FILE = "smartfolder_index.sqlite"
+
+WRITE_BATCH_SIZE = 1000  # Records written (and read back) per locked statement
+SNIPPET_LENGTH = 200  # Leading characters of text kept as a record's search-result snippet
+
+_CONNECTION = None
+_LOCK = threading.Lock()  # Endpoints run on FastAPI's threadpool and share one connection
+
+_COLUMNS = ("path", "filename", "size", "mtime", "fingerprint", "hash", "indexed", "file_type",
+            "text_content", "snippet", "embedding_vector", "embedding_model", "faces_detected")
+
+def _create_table(conn: sqlite3.Connection, table: str):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {table} ("
+        "path TEXT PRIMARY KEY, filename TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL, "
+        "fingerprint TEXT, "  # Size and mtime; see scanner.stat_signature
+        "hash TEXT NOT NULL DEFAULT '', indexed INTEGER NOT NULL DEFAULT 0, "
+        "file_type TEXT NOT NULL DEFAULT 'unknown', "
+        "text_content TEXT, "  # NULL when no text was extracted
+        "snippet TEXT, "  # Leading text shown in search results
+        "embedding_vector BLOB, "  # float32 bytes, NULL when there is no embedding
+        "embedding_model TEXT, "  # Model that produced the embedding
+        "faces_detected TEXT)"  # JSON list of cluster ids, NULL when no faces were found
+    )
+
+def _get_connection() -> sqlite3.Connection:
+    """Opens the index database on first use."""
+    global _CONNECTION
+    if _CONNECTION is None:
+        _CONNECTION = sqlite3.connect(INDEX_DB_FILE, check_same_thread=False)
+        _CONNECTION.execute("PRAGMA journal_mode=WAL")
+        _create_table(_CONNECTION, "files")
+        _CONNECTION.execute("CREATE INDEX IF NOT EXISTS idx_hash ON files(hash)")
+    return _CONNECTION
+
+def _to_row(record: Dict[str, Any]) -> Tuple:
+    embedding = record.get("embedding_vector")
+    faces = record.get("faces_detected")
+    return (
+        record["path"],
+        record["filename"],
+        record.get("size", 0),
+        record.get("mtime"),
+        record.get("fingerprint") or None,
+        record.get("hash", ""),
+        int(bool(record.get("indexed"))),
+        record.get("file_type", "unknown"),
+        record.get("text_content") or None,
+        record.get("snippet") or None,
+        np.asarray(embedding, dtype=np.float32).tobytes() if embedding is not None and len(embedding) else None,
+        record.get("embedding_model") or None,
+        json.dumps(faces) if faces else None,
+    )
+
+def _from_row(row: Tuple) -> Dict[str, Any]:
+    (path, filename, size, mtime, fingerprint, file_hash, indexed, file_type, text, snippet, embedding,
+     embedding_model, faces) = row
+    return {
+        "path": path,
+        "filename": filename,
+        "size": size,
+        "mtime": mtime,
+        "fingerprint": fingerprint or "",
+        "hash": file_hash,
+        "indexed": bool(indexed),
+        "file_type": sys.intern(file_type),  # A handful of values shared by every record
+        "text_content": text or "",
+        "snippet": snippet or "",
+        "embedding_vector": np.frombuffer(embedding, dtype=np.float32) if embedding else None,
+        "embedding_model": embedding_model or "",
+        "faces_detected": json.loads(faces) if faces else [],
+    }
+
+def replace_all(records: Iterable[Dict[str, Any]]):
+    """Replaces the stored index with the given records, which may be a generator.
+
+    Records are written in WRITE_BATCH_SIZE batches to a staging table that is swapped in at
+    the end, so a scan can stream into the store while readers (and get()) still see the
+    previous index.
+    """
+    placeholders = ",".join("?" * len(_COLUMNS))
+    insert = f"INSERT OR REPLACE INTO files_next ({','.join(_COLUMNS)}) VALUES ({placeholders})"
+    with _LOCK:
+        conn = _get_connection()
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS files_next")
+            _create_table(conn, "files_next")
+    
+    batch = []
+    for record in records:
+        batch.append(_to_row(record))
+        if len(batch) >= WRITE_BATCH_SIZE:
+            with _LOCK:
+                conn = _get_connection()
+                with conn:
+                    conn.executemany(insert, batch)
+            batch = []
+    
+    with _LOCK:
+        conn = _get_connection()
+        with conn:
+            conn.executemany(insert, batch)
+            conn.execute("DROP TABLE files")
+            conn.execute("ALTER TABLE files_next RENAME TO files")
+            conn.execute("CREATE INDEX idx_hash ON files(hash)")
+
+def get(path: str) -> Optional[Dict[str, Any]]:
+    """Returns the stored record for a path, or None."""
+    with _LOCK:
+        row = _get_connection().execute(
+            f"SELECT {','.join(_COLUMNS)} FROM files WHERE path = ?", (path,)
+        ).fetchone()
+    return _from_row(row) if row is not None else None
+
+def iter_records() -> Iterator[Dict[str, Any]]:
+    """Yields every stored record as a dict, in insertion order.
+
+    Rows are fetched WRITE_BATCH_SIZE at a time, so the whole table is never held in memory.
+    """
+    last_rowid = 0
+    while True:
+        with _LOCK:
+            rows = _get_connection().execute(
+                f"SELECT rowid, {','.join(_COLUMNS)} FROM files WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, WRITE_BATCH_SIZE)
+            ).fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        for row in rows:
+            yield _from_row(row[1:])
+
+def get_snippets(paths: List[str]) -> Dict[str, str]:
+    """Returns the stored snippets for the given paths (paths without one are omitted)."""
+    if not paths:
+        return {}
+    placeholders = ",".join("?" * len(paths))
+    with _LOCK:
+        rows = _get_connection().execute(
+            f"SELECT path, snippet FROM files WHERE snippet IS NOT NULL AND path IN ({placeholders})",
+            list(paths)
+        ).fetchall()
+    return dict(rows)
+
+def count() -> int:
+    """Number of stored records."""
+    with _LOCK:
+        return _get_connection().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+def group_by_file_type() -> List[Tuple[str, int, int, int, int, int]]:
+    """Per file type: (file_type, files, total size, indexed, with text, with faces)."""
+    with _LOCK:
+        return _get_connection().execute(
+            "SELECT file_type, COUNT(*), COALESCE(SUM(size), 0), SUM(indexed), "
+            "SUM(text_content IS NOT NULL), SUM(faces_detected IS NOT NULL) "
+            "FROM files GROUP BY file_type"
+        ).fetchall()
+
+def duplicate_groups(limit: int = 20) -> List[Dict[str, Any]]:
+    """Returns up to `limit` groups of files sharing a content hash, largest groups first.
+
+    Each group is {"hash", "files": [{"path", "filename"}, ...]} with the shortest path first.
+    """
+    with _LOCK:
+        rows = _get_connection().execute(
+            "SELECT hash, json_group_array(json_object('path', path, 'filename', filename)) "
+            "FROM files WHERE hash != '' GROUP BY hash HAVING COUNT(*) > 1 "
+            "ORDER BY COUNT(*) DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+    groups = []
+    for file_hash, files in rows:
+        # Sorting happens per returned group, so at most `limit` small lists
+        files = sorted(json.loads(files), key=lambda f: len(f["path"]))
+        groups.append({"hash": file_hash, "files": files})
+    return groups
@@ -1,15 +1,49 @@
 from qdrant_client import QdrantClient, models
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional
+import atexit
 import os
 import numpy as np
+from .hashing import hash64
+from . import index_store
 
-# Qdrant setup
-QDRANT_CLIENT = QdrantClient(":memory:")  # In-memory for demo, use actual server in production
+# Qdrant setup: in-memory for demo, set QDRANT_URL to use an actual server in production
+QDRANT_URL = os.getenv("QDRANT_URL")
+if QDRANT_URL:
+    # gRPC sends vectors as packed protobuf floats instead of JSON text
+    QDRANT_CLIENT = QdrantClient(
+        url=QDRANT_URL,
+        prefer_grpc=True,
+        grpc_port=int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+    )
+else:
+    QDRANT_CLIENT = QdrantClient(":memory:")
 COLLECTION_NAME = "smartfolder_index"
 VECTOR_DIMENSION = 384  # Updated to match our embedding dimension
+UPSERT_BATCH_SIZE = 512  # Points buffered before a single upsert round-trip
+
+_PENDING_POINTS: List[models.PointStruct] = []
+_PENDING_KEYS = set()  # Indexed keys of the buffered points, recorded once their upsert succeeds
+_QDRANT_READY = False  # Set once the collection is known to exist
+_INDEXED_KEYS = set()  # hash64 of "path:content hash:model" for every point already sent to Qdrant
+
+# int8 copies of the vectors drive HNSW traversal at a quarter of the memory (server only)
+QUANTIZATION_CONFIG = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(
+        type=models.ScalarType.INT8,
+        quantile=0.99,
+        always_ram=True
+    )
+)
+# Rescore 2x oversampled int8 candidates with the original float32 vectors
+QUANTIZED_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
 
 def initialize_qdrant():
-    """Initializes the Qdrant collection if it does not exist."""
+    """Initializes the Qdrant collection if it does not exist (a no-op once it has succeeded)."""
+    global _QDRANT_READY
+    if _QDRANT_READY:
+        return
     try:
         # Check if collection exists
         collections = QDRANT_CLIENT.get_collections()
@@ -18,56 +52,151 @@ def initialize_qdrant():
         if not collection_exists:
             QDRANT_CLIENT.create_collection(
                 collection_name=COLLECTION_NAME,
+                # Vectors are unit-normalized client-side, so dot product equals cosine similarity
                 vectors_config=models.VectorParams(
                     size=VECTOR_DIMENSION, 
-                    distance=models.Distance.COSINE
+                    distance=models.Distance.DOT
                 ),
+                quantization_config=QUANTIZATION_CONFIG if QDRANT_URL else None,
             )
             print(f"Qdrant collection '{COLLECTION_NAME}' created.")
         else:
             print(f"Qdrant collection '{COLLECTION_NAME}' already exists.")
+            _load_indexed_keys()
+        
+        _QDRANT_READY = True
             
     except Exception as e:
         print(f"Error initializing Qdrant: {e}")
         raise
 
+def _indexed_key(path: str, content_hash: str, embedding_model: str) -> int:
+    """Key for one version of a file; changes whenever its content or embedding model does."""
+    return hash64(f"{path}:{content_hash}:{embedding_model}")
+
+def _load_indexed_keys():
+    """Rebuilds the set of already-indexed file versions by scrolling the collection once."""
+    _INDEXED_KEYS.clear()
+    offset = None
+    while True:
+        points, offset = QDRANT_CLIENT.scroll(
+            collection_name=COLLECTION_NAME,
+            limit=1024,
+            offset=offset,
+            with_payload=["path", "hash", "embedding_model"],
+            with_vectors=False
+        )
+        for point in points:
+            payload = point.payload
+            _INDEXED_KEYS.add(_indexed_key(
+                payload.get("path", ""), payload.get("hash", ""), payload.get("embedding_model", "")
+            ))
+        if offset is None:
+            break
+
+def normalize_vector(vector) -> Optional[List[float]]:
+    """Returns the vector scaled to unit length as float32 values (None for a zero vector)."""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    if norm == 0:
+        return None
+    return (array / norm).tolist()
+
+def flush_index(wait: bool = True):
+    """Upserts all buffered points into Qdrant in one request.
+
+    Points only count as indexed once the upsert succeeds; a failed batch is dropped from the
+    buffer but not recorded, so the next indexing run sends those files again.
+    """
+    global _PENDING_POINTS, _PENDING_KEYS
+    if not _PENDING_POINTS:
+        return
+    
+    points, _PENDING_POINTS = _PENDING_POINTS, []
+    keys, _PENDING_KEYS = _PENDING_KEYS, set()
+    try:
+        QDRANT_CLIENT.upsert(
+            collection_name=COLLECTION_NAME,
+            points=points,
+            wait=wait
+        )
+    except Exception as e:
+        print(f"Error upserting {len(points)} points to Qdrant: {e}")
+        return
+    _INDEXED_KEYS.update(keys)
+
+atexit.register(flush_index)
+
 def index_file_record(record: Dict[str, Any]):
-    """Indexes a single file record into the Qdrant vector store."""
+    """Queues a single file record for indexing into the Qdrant vector store.
+
+    Points are sent in batches of UPSERT_BATCH_SIZE; call flush_index() once all
+    records have been queued. Files already indexed with the same content hash and
+    embedding model are skipped unless the record sets 'force'.
+    """
     embedding_vector = record.get("embedding_vector")
-    if not embedding_vector:
+    if embedding_vector is None or len(embedding_vector) == 0:
+        return
+    
+    # Read each field once; the same values feed the dedup key and the payload
+    path = record["path"]
+    filename = record["filename"]
+    content_hash = record.get("hash", "")
+    embedding_model = record.get("embedding_model", "")
+    
+    indexed_key = _indexed_key(path, content_hash, embedding_model)
+    if (indexed_key in _INDEXED_KEYS or indexed_key in _PENDING_KEYS) and not record.get("force"):
         return
     
     try:
-        # Ensure vector is the right size
-        if len(embedding_vector) != VECTOR_DIMENSION:
-            print(f"Warning: Vector dimension mismatch. Expected {VECTOR_DIMENSION}, got {len(embedding_vector)}")
+        # Convert once; the dimension check and normalization share the array
+        vector = np.asarray(embedding_vector, dtype=np.float32)
+        if vector.shape != (VECTOR_DIMENSION,):
+            print(f"Warning: Vector dimension mismatch. Expected {VECTOR_DIMENSION}, got {len(vector)}")
+            return
+        
+        # A zero vector has no direction, so it can't be ranked by cosine similarity
+        unit_vector = normalize_vector(vector)
+        if unit_vector is None:
             return
         
-        # Create a point for Qdrant
-        point_id = abs(hash(record["path"])) % (2**63)  # Ensure positive ID
+        # Create a point for Qdrant (stable across restarts, kept within signed 64-bit range)
+        point_id = hash64(path) & 0x7FFFFFFFFFFFFFFF
         
         point = models.PointStruct(
             id=point_id,
-            vector=embedding_vector,
+            vector=unit_vector,
             payload={
-                "path": record["path"],
-                "filename": record["filename"],
+                "path": path,
+                "filename": filename,
                 "file_type": record.get("file_type", "unknown"),
                 "size": record.get("size", 0),
-                "hash": record.get("hash", ""),
-                "text_content": record.get("text_content", "")[:1000],  # Limit payload size
+                "hash": content_hash,
+                "embedding_model": embedding_model,
                 "faces_detected": record.get("faces_detected", [])
             }
         )
         
-        QDRANT_CLIENT.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[point],
-            wait=True
-        )
+        _PENDING_POINTS.append(point)
+        _PENDING_KEYS.add(indexed_key)
+        if len(_PENDING_POINTS) >= UPSERT_BATCH_SIZE:
+            # Don't block on intermediate batches; the final flush waits
+            flush_index(wait=False)
         
     except Exception as e:
-        print(f"Error indexing {record['filename']} to Qdrant: {e}")
+        print(f"Error indexing {filename} to Qdrant: {e}")
+
+def index_file_records_batch(records: Iterable[Dict[str, Any]]) -> int:
+    """Indexes many file records (any iterable), sending them in UPSERT_BATCH_SIZE upserts.
+
+    Returns the number of records submitted; all of them are flushed before returning.
+    """
+    submitted = 0
+    for record in records:
+        index_file_record(record)
+        submitted += 1
+    flush_index()
+    return submitted
 
 def search_qdrant(query_vector: List[float], top_k: int = 10) -> List[Dict[str, Any]]:
     """Performs a vector search in Qdrant."""
@@ -77,23 +206,33 @@ def search_qdrant(query_vector: List[float], top_k: int = 10) -> List[Dict[str,
             print(f"Warning: Query vector dimension mismatch. Expected {VECTOR_DIMENSION}, got {len(query_vector)}")
             return []
         
+        # Normalize the query the same way as the stored vectors so DOT scores are cosines
+        unit_query = normalize_vector(query_vector)
+        if unit_query is None:
+            return []
+        
         search_result = QDRANT_CLIENT.search(
             collection_name=COLLECTION_NAME,
-            query_vector=query_vector,
+            query_vector=unit_query,
             limit=top_k,
             with_payload=True,
-            score_threshold=0.1  # Minimum similarity threshold
+            score_threshold=0.1,  # Minimum similarity threshold
+            search_params=QUANTIZED_SEARCH_PARAMS if QDRANT_URL else None
         )
         
+        # Snippets are kept out of the payload; fetch them from the index store in one query
+        snippets = index_store.get_snippets([hit.payload.get("path", "") for hit in search_result])
+        
         results = []
         for hit in search_result:
+            snippet = snippets.get(hit.payload.get("path", ""), "")
             result = {
                 "path": hit.payload.get("path", ""),
                 "filename": hit.payload.get("filename", ""),
                 "file_type": hit.payload.get("file_type", "unknown"),
                 "size": hit.payload.get("size", 0),
                 "score": hit.score,
-                "snippet": hit.payload.get("text_content", "")[:200] + "..." if hit.payload.get("text_content") else "",
+                "snippet": snippet + "..." if snippet else "",
                 "faces_detected": hit.payload.get("faces_detected", [])
             }
             results.append(result)
@@ -120,8 +259,13 @@ def get_collection_info():
 
 def clear_collection():
     """Clear all points from the collection (useful for testing)."""
+    global _QDRANT_READY
     try:
+        _PENDING_POINTS.clear()
+        _PENDING_KEYS.clear()
+        _INDEXED_KEYS.clear()
         QDRANT_CLIENT.delete_collection(COLLECTION_NAME)
+        _QDRANT_READY = False
         initialize_qdrant()
         print("Collection cleared and reinitialized.")
     except Exception as e:
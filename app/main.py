@@ -1,20 +1,34 @@
 import os
 import platform
-from fastapi import FastAPI, HTTPException
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from .scanner import scan_directory, load_index, search_files
-from .indexer import initialize_qdrant, index_file_record, search_qdrant
-from .face_cluster import get_face_clusters_summary, get_images_for_cluster
+from typing import Dict, List, Optional
+from uuid import uuid4
 from dotenv import load_dotenv
-import json
 
-# Load environment variables
+# Load environment variables before the app modules read their settings at import time
 load_dotenv(dotenv_path="sample.env")
 
-app = FastAPI(title="Smart Folder Organizer API")
+from .scanner import iter_scan, save_index, refresh_search_index, search_files
+from . import index_store
+from .search_index import build_fts, fts_search
+from .indexer import initialize_qdrant, index_file_records_batch, search_qdrant
+from .face_cluster import get_face_clusters_summary, get_face_cluster_count, get_images_for_cluster, get_thumbnail_path
+import json
+
+try:
+    import orjson  # Optional: C/SIMD JSON encoder, several times faster than the json module
+except ImportError:
+    orjson = None
+
+app = FastAPI(
+    title="Smart Folder Organizer API",
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse
+)
 
 # --- Configuration ---
 # Default scan paths based on OS
@@ -35,8 +49,16 @@ def get_default_scan_paths():
         return ["/data"]
 
 # Global state
-current_index = []
 current_scan_paths = get_default_scan_paths()
+scan_jobs: Dict[str, dict] = {}  # job_id -> progress and, once finished, the scan result
+MAX_SCAN_JOBS = 20  # Finished jobs kept for polling; older ones are dropped as new scans start
+
+# Folder probes re-read the disk, so /api/default-paths results are reused for a while
+FOLDER_PROBE_TTL = 60  # seconds
+# path -> (dir mtime_ns, computed at, size); each update is a single assignment, so worker
+# threads and concurrent requests can share it without a lock
+_SIZE_ESTIMATE_CACHE = {}
+_COMMON_FOLDERS_CACHE = None  # (computed at, folders)
 
 # --- Request Models ---
 class SearchRequest(BaseModel):
@@ -54,6 +76,9 @@ def get_scan_status():
     """Get current scan status and statistics."""
     try:
         if os.path.exists("scan_summary.json"):
+            if orjson is not None:
+                with open("scan_summary.json", 'rb') as f:
+                    return orjson.loads(f.read())
             with open("scan_summary.json", 'r') as f:
                 summary = json.load(f)
             return summary
@@ -76,23 +101,9 @@ def validate_paths(paths: List[str]) -> List[str]:
 def get_default_paths():
     """Get suggested default scan paths based on the operating system."""
     paths = get_default_scan_paths()
-    # Check which paths actually exist and are accessible
-    available_paths = []
-    for path in paths:
-        if os.path.exists(path) and os.access(path, os.R_OK):
-            available_paths.append({
-                "path": path,
-                "exists": True,
-                "readable": True,
-                "size_estimate": get_directory_size_estimate(path)
-            })
-        else:
-            available_paths.append({
-                "path": path,
-                "exists": os.path.exists(path),
-                "readable": False,
-                "size_estimate": 0
-            })
+    # Probe the folders concurrently; the stat calls release the GIL so the walks overlap
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        available_paths = list(executor.map(probe_path, paths))
     
     return {
         "default_paths": available_paths,
@@ -100,8 +111,31 @@ def get_default_paths():
         "common_folders": get_common_folders()
     }
 
+def probe_path(path: str) -> dict:
+    """Check whether a path exists and is accessible, with a size estimate if readable."""
+    if os.path.exists(path) and os.access(path, os.R_OK):
+        return {
+            "path": path,
+            "exists": True,
+            "readable": True,
+            "size_estimate": get_directory_size_estimate(path)
+        }
+    return {
+        "path": path,
+        "exists": os.path.exists(path),
+        "readable": False,
+        "size_estimate": 0
+    }
+
 def get_common_folders():
-    """Get common folders that users might want to scan."""
+    """Get common folders that users might want to scan (cached for FOLDER_PROBE_TTL seconds)."""
+    global _COMMON_FOLDERS_CACHE
+    now = time.monotonic()
+    if _COMMON_FOLDERS_CACHE is None or now - _COMMON_FOLDERS_CACHE[0] >= FOLDER_PROBE_TTL:
+        _COMMON_FOLDERS_CACHE = (now, _find_common_folders())
+    return list(_COMMON_FOLDERS_CACHE[1])
+
+def _find_common_folders():
     common = []
     if platform.system() == "Windows":
         # Windows common folders
@@ -144,30 +178,54 @@ def get_common_folders():
     return common
 
 def get_directory_size_estimate(path: str) -> int:
-    """Get a rough estimate of directory size (first 1000 files)."""
+    """Get a rough estimate of directory size (first 1000 files).
+
+    Estimates are reused for FOLDER_PROBE_TTL seconds, or until the directory itself changes.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+    now = time.monotonic()
+    cached = _SIZE_ESTIMATE_CACHE.get(path)
+    if cached is not None and cached[0] == mtime_ns and now - cached[1] < FOLDER_PROBE_TTL:
+        return cached[2]
+    
+    size = _estimate_directory_size(path)
+    # Replaces any stale estimate, so the cache holds one entry per folder
+    _SIZE_ESTIMATE_CACHE[path] = (mtime_ns, now, size)
+    return size
+
+def _estimate_directory_size(path: str) -> int:
     try:
         total_size = 0
         file_count = 0
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                if file_count >= 1000:  # Limit for performance
-                    break
-                try:
-                    file_path = os.path.join(root, file)
-                    total_size += os.path.getsize(file_path)
-                    file_count += 1
-                except (OSError, IOError):
-                    continue
-            if file_count >= 1000:
-                break
+        # scandir entries carry the file type from readdir, so only sizes need a stat call
+        stack = [path]
+        while stack and file_count < 1000:  # Limit for performance
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if file_count >= 1000:
+                            break
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                total_size += entry.stat(follow_symlinks=False).st_size
+                                file_count += 1
+                        except OSError:
+                            continue
+            except OSError:
+                continue
         return total_size
     except:
         return 0
 
 @app.post("/api/scan")
-def scan_folders(request: Optional[ScanRequest] = None):
-    """Starts the recursive folder scan and indexing process."""
-    global current_index, current_scan_paths
+async def scan_folders(background_tasks: BackgroundTasks, request: Optional[ScanRequest] = None):
+    """Starts the recursive folder scan and indexing process as a background job."""
+    global current_scan_paths
     
     # Use provided paths or current scan paths
     if request and request.paths:
@@ -179,25 +237,56 @@ def scan_folders(request: Optional[ScanRequest] = None):
     if not scan_paths:
         raise HTTPException(status_code=400, detail="No valid scan paths provided or found")
     
+    # Scans replace the shared index, so only one may run at a time
+    if any(job["state"] == "running" for job in scan_jobs.values()):
+        raise HTTPException(status_code=409, detail="A scan is already running")
+    
+    # Only one job runs at a time, so every existing job is finished; keep the newest few
+    for old_job_id in list(scan_jobs)[:max(0, len(scan_jobs) - MAX_SCAN_JOBS + 1)]:
+        del scan_jobs[old_job_id]
+    
+    job_id = uuid4().hex
+    scan_jobs[job_id] = {
+        "job_id": job_id,
+        "state": "running",
+        "status": "Scan started",
+        "scan_paths": scan_paths
+    }
+    background_tasks.add_task(run_scan_job, job_id, scan_paths)
+    return dict(scan_jobs[job_id])
+
+@app.get("/api/scan/{job_id}")
+def get_scan_job(job_id: str):
+    """Returns the progress, or the final result, of a scan job."""
+    job = scan_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    # A snapshot: the background job keeps updating its dict while the response is serialized
+    return dict(job)
+
+def run_scan_job(job_id: str, scan_paths: List[str]):
+    """Performs a scan and indexing run, recording each phase in scan_jobs[job_id]."""
+    job = scan_jobs[job_id]
     try:
         print(f"Starting scan of paths: {scan_paths}")
         
-        # Perform the scan
-        file_records = scan_directory(scan_paths)
-        current_index = file_records
+        # Scan and save in one streamed pass; records go to the index store as they finish
+        job["status"] = "Scanning files"
+        save_index(iter_scan(scan_paths))
         
-        # Save the index
-        from .scanner import save_index
-        save_index(file_records)
+        # Build the search indexes from the store rather than an in-memory copy of the scan
+        job["status"] = "Building search index"
+        refresh_search_index()
+        build_fts(index_store.iter_records())
         
         # Initialize Qdrant and index content
+        job["status"] = "Indexing vectors"
         try:
             initialize_qdrant()
-            indexed_count = 0
-            for record in file_records:
-                if record.get("indexed") and record.get("embedding_vector"):
-                    index_file_record(record)
-                    indexed_count += 1
+            indexed_count = index_file_records_batch(
+                record for record in index_store.iter_records()
+                if record.get("indexed") and record.get("embedding_vector") is not None
+            )
         except Exception as e:
             print(f"Warning: Vector indexing failed: {e}")
             indexed_count = 0
@@ -205,30 +294,28 @@ def scan_folders(request: Optional[ScanRequest] = None):
         # Get final statistics
         stats = get_scan_status()
         
-        return {
+        job.update({
+            "state": "complete",
             "status": "Scan and indexing complete", 
-            "total_files": len(file_records),
-            "indexed_files": len([r for r in file_records if r.get("indexed", False)]),
+            "total_files": stats.get("total_files", 0),
+            "indexed_files": stats.get("indexed_files", 0),
             "vector_indexed": indexed_count,
-            "file_types": stats.get("file_types", {}),
-            "scan_paths": scan_paths
-        }
+            "file_types": stats.get("file_types", {})
+        })
         
     except Exception as e:
         print(f"Error during scan: {e}")
-        raise HTTPException(status_code=500, detail=f"Scan failed: {str(e)}")
+        job.update({"state": "failed", "status": f"Scan failed: {str(e)}"})
 
 @app.post("/api/search")
 def search_files_endpoint(request: SearchRequest):
     """Performs keyword or semantic search."""
-    global current_index
-    
     try:
-        # Load index if not in memory
-        if not current_index:
-            current_index = load_index()
+        # Keyword queries go straight to the full-text index; no records are loaded
+        if request.search_type == "keyword":
+            return fts_search(request.query)
         
-        if not current_index:
+        if index_store.count() == 0:
             return {"error": "No index found. Please run a scan first.", "results": []}
         
         # Perform search using the enhanced search function
@@ -242,7 +329,7 @@ def search_files_endpoint(request: SearchRequest):
                 "path": record.get("path", ""),
                 "file_type": record.get("file_type", "unknown"),
                 "size": record.get("size", 0),
-                "snippet": record.get("text_content", "")[:200] + "..." if record.get("text_content") else "",
+                "snippet": record["snippet"] + "..." if record.get("snippet") else "",
                 "relevance": record.get("relevance", 0.0)
             }
             
@@ -278,6 +365,23 @@ def get_face_cluster_images(cluster_id: int):
         print(f"Error getting cluster images: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get cluster images: {str(e)}")
 
+@app.get("/api/thumbnails/{thumb_id}.jpg")
+async def get_thumbnail(thumb_id: str):
+    """Serves a cached face thumbnail.
+
+    Runs on the event loop: the lookup is a single stat, and FileResponse streams the file
+    asynchronously, so no threadpool slot is held while galleries load.
+    """
+    thumb_path = get_thumbnail_path(thumb_id)
+    if thumb_path is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    # Ids are derived from the source file's path, mtime and size, so a URL never changes content
+    return FileResponse(
+        thumb_path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
 @app.get("/api/status")
 def get_status():
     """Returns the current status of the system."""
@@ -290,8 +394,8 @@ def get_status():
             "total_files": stats.get("total_files", 0),
             "indexed_files": stats.get("indexed_files", 0),
             "file_types": stats.get("file_types", {}),
-            "index_exists": os.path.exists("smartfolder_index.json"),
-            "face_clusters": len(get_face_clusters_summary()),
+            "index_exists": os.path.exists(index_store.INDEX_DB_FILE),
+            "face_clusters": get_face_cluster_count(),
             "os": platform.system()
         }
         
@@ -308,62 +412,55 @@ def get_status():
 @app.get("/api/stats")
 def get_detailed_stats():
     """Get detailed statistics about the indexed files."""
-    global current_index
-    
     try:
-        if not current_index:
-            current_index = load_index()
+        # One aggregate query; totals are summed over the handful of file types
+        type_rows = index_store.group_by_file_type()
         
-        if not current_index:
+        if not type_rows:
             return {"error": "No data available"}
         
         stats = {
-            "total_files": len(current_index),
-            "total_size": sum(record.get("size", 0) for record in current_index),
-            "file_types": {},
-            "indexed_files": 0,
-            "files_with_text": 0,
-            "files_with_faces": 0
+            "total_files": sum(row[1] for row in type_rows),
+            "total_size": sum(row[2] for row in type_rows),
+            "file_types": {row[0]: row[1] for row in type_rows},
+            "indexed_files": sum(row[3] for row in type_rows),
+            "files_with_text": sum(row[4] for row in type_rows),
+            "files_with_faces": sum(row[5] for row in type_rows)
         }
         
-        for record in current_index:
-            # File type distribution
-            file_type = record.get("file_type", "unknown")
-            stats["file_types"][file_type] = stats["file_types"].get(file_type, 0) + 1
-            
-            # Content analysis
-            if record.get("indexed"):
-                stats["indexed_files"] += 1
-            if record.get("text_content"):
-                stats["files_with_text"] += 1
-            if record.get("faces_detected"):
-                stats["files_with_faces"] += 1
-        
         return stats
         
     except Exception as e:
         print(f"Error getting detailed stats: {e}")
         return {"error": str(e)}
 
+@app.get("/api/duplicates")
+def get_duplicate_files(limit: int = 20):
+    """Lists groups of files with identical content, largest groups first."""
+    try:
+        # Grouped and limited in SQL; only the returned groups are sorted in Python
+        return {"duplicates": index_store.duplicate_groups(limit)}
+    except Exception as e:
+        print(f"Error finding duplicates: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to find duplicates: {str(e)}")
+
 # --- Initialize on startup ---
 @app.on_event("startup")
 async def startup_event():
     """Initialize the application on startup."""
-    global current_index
-    
     print("Smart Folder Organizer starting up...")
     print(f"Operating System: {platform.system()}")
     print(f"Default scan paths: {current_scan_paths}")
     
-    # Load existing index if available
+    # Records stay on disk; searches load what they need on demand
     try:
-        current_index = load_index()
-        if current_index:
-            print(f"Loaded existing index with {len(current_index)} files")
+        file_count = index_store.count()
+        if file_count:
+            print(f"Found existing index with {file_count} files")
         else:
             print("No existing index found")
     except Exception as e:
-        print(f"Error loading index: {e}")
+        print(f"Error opening index: {e}")
     
     # Initialize vector database
     try:
@@ -383,4 +480,6 @@ else:
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    # Passed as an import string so uvicorn can spawn WEB_CONCURRENCY worker processes;
+    # uvloop and httptools are picked up automatically when installed (uvicorn[standard])
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8080)
\ No newline at end of file
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+from typing import Optional, Tuple
+import numpy as np
+
+# Extracted text and embeddings keyed by content hash, so renamed, moved or duplicated
+# files skip OCR and embedding on later scans
+OCR_CACHE_DB_FILE = "smartfolder_ocr_cache.sqlite"
+
+_CONNECTION = None
+_LOCK = threading.Lock()  # Scan worker threads share one connection
+
+def _get_connection() -> sqlite3.Connection:
+    """Opens the cache database on first use."""
+    global _CONNECTION
+    if _CONNECTION is None:
+        _CONNECTION = sqlite3.connect(OCR_CACHE_DB_FILE, check_same_thread=False)
+        _CONNECTION.execute("PRAGMA journal_mode=WAL")
+        # A lost entry after a crash only costs a re-extraction, so skip per-commit fsyncs
+        _CONNECTION.execute("PRAGMA synchronous=NORMAL")
+        _CONNECTION.execute(
+            "CREATE TABLE IF NOT EXISTS content_cache ("
+            "hash TEXT PRIMARY KEY, text_content TEXT NOT NULL, "
+            "embedding BLOB, "  # float32 bytes, NULL when the file has no text
+            "embedding_model TEXT)"  # What produced the embedding
+        )
+    return _CONNECTION
+
+def _reset_in_child():
+    """Drops the inherited connection in a forked scan worker; SQLite handles can't cross a fork."""
+    global _CONNECTION, _LOCK
+    _CONNECTION = None
+    _LOCK = threading.Lock()
+
+if hasattr(os, "register_at_fork"):  # Not on Windows, where workers are spawned fresh
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+def get(content_hash: str, embedding_model: str) -> Optional[Tuple[str, Optional[np.ndarray]]]:
+    """Returns (text_content, embedding_vector) for a content hash, or None on a miss.
+
+    The embedding is None unless it was produced by `embedding_model`; the text is still valid.
+    """
+    with _LOCK:
+        row = _get_connection().execute(
+            "SELECT text_content, embedding, embedding_model FROM content_cache WHERE hash = ?",
+            (content_hash,)
+        ).fetchone()
+    if row is None:
+        return None
+    text_content, embedding, model = row
+    if not embedding or model != embedding_model:
+        return text_content, None
+    return text_content, np.frombuffer(embedding, dtype=np.float32)
+
+def put(content_hash: str, text_content: str, embedding_vector: Optional[np.ndarray], embedding_model: str):
+    """Stores the extraction results for a content hash."""
+    embedding = np.asarray(embedding_vector, dtype=np.float32).tobytes() if embedding_vector is not None else None
+    with _LOCK:
+        conn = _get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO content_cache (hash, text_content, embedding, embedding_model) "
+                "VALUES (?, ?, ?, ?)",
+                (content_hash, text_content, embedding, embedding_model)
+            )
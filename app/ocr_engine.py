@@ -1,7 +1,17 @@
 import os
-from PIL import Image
 from typing import Optional
 
+# Leading bytes of each supported image format; a file whose header matches is treated as a
+# valid image without going through PIL's decoder and plugin registry
+IMAGE_SIGNATURES = {
+    '.jpg': (b'\xff\xd8\xff',),
+    '.jpeg': (b'\xff\xd8\xff',),
+    '.png': (b'\x89PNG\r\n\x1a\n',),
+    '.tiff': (b'II*\x00', b'MM\x00*'),
+    '.bmp': (b'BM',),
+}
+SIGNATURE_LENGTH = 8  # Bytes read to check the longest signature
+
 def ocr_file(filepath: str) -> str:
     """
     Enhanced OCR function with better file handling and more realistic output.
@@ -13,13 +23,14 @@ def ocr_file(filepath: str) -> str:
     _, ext = os.path.splitext(filepath)
     ext = ext.lower()
     
-    if ext in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp']:
+    if ext in IMAGE_SIGNATURES:
         try:
             # Verify it's a valid image
-            with Image.open(filepath) as img:
-                # Get image info for more realistic mock content
-                width, height = img.size
-                mode = img.mode
+            with open(filepath, 'rb', buffering=0) as f:
+                header = f.read(SIGNATURE_LENGTH)
+            if not header.startswith(IMAGE_SIGNATURES[ext]):
+                print(f"Error processing image {filepath}: not a valid {ext[1:].upper()} file")
+                return ""
             
             # Generate more realistic OCR content based on filename
             filename = os.path.basename(filepath).lower()
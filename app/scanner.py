@@ -1,202 +1,762 @@
 import os
+import codecs
 import hashlib
 import json
+import mmap
+import numpy as np
 import platform
-from typing import List, Dict, Any, Optional
+import re
+import sys
+import threading
+from bisect import bisect_left
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from .ocr_engine import ocr_file
-from .face_cluster import detect_and_encode_faces, cluster_faces
+from .face_cluster import detect_and_encode_faces, cluster_faces, thumbnail_batch
+from . import index_store, ocr_cache
+from .index_store import SNIPPET_LENGTH
+
+try:
+    import orjson  # Optional: faster JSON encoding for the scan summary
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash  # Optional: non-cryptographic hashing fallback when blake3 is missing
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3  # Optional: SIMD (AVX2/AVX-512) content hashing, several times faster than SHA256
+except ImportError:
+    blake3 = None
+
+try:
+    import charset_normalizer  # Optional: detects the encoding of non-UTF-8 text files
+except ImportError:
+    charset_normalizer = None
+
+try:
+    from sentence_transformers import SentenceTransformer  # Optional: real text embeddings
+except ImportError:
+    SentenceTransformer = None
 
 # Enhanced index structure
-INDEX_FILE = "smartfolder_index.json"
+INDEX_FILE = index_store.INDEX_DB_FILE
 SEARCH_INDEX = {}  # In-memory search index for better performance
+_KEYWORD_INDEX_LOCK = threading.Lock()  # Concurrent first keyword searches build the maps once
+EMBEDDING_DIMENSION = 384
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")  # Must produce 384-dim vectors
+HASH_EMBEDDING_MODEL = "md5-hash"  # Names the MD5 fallback in the OCR cache
+EMBEDDING_BATCH_SIZE = 64  # Texts per model forward pass during a scan
+# Shared, read-only embedding of empty text, so callers never allocate one
+ZERO_EMBEDDING = np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
+ZERO_EMBEDDING.setflags(write=False)
+EMBEDDING_QUANT_LEVELS = 127  # In-memory embeddings are int8 in [-127, 127] times a per-row scale
+SIMILARITY_BLOCK_ROWS = 16384  # int8 rows widened to float32 at a time when scoring
+SEARCH_RESULT_LIMIT = 50  # Records returned by search_files
+SMALL_FILE_SIZE = 128 * 1024  # Files up to this size are read in one call and hashed from memory
+TEXT_PREVIEW_CHARS = 2000  # Leading characters of a text file kept as its content
+TEXT_SAMPLE_BYTES = 4 * TEXT_PREVIEW_CHARS  # Enough raw bytes for that many UTF-8 characters
+# Legacy code pages tried first when charset_normalizer finds several equally clean decodings
+PREFERRED_ENCODINGS = ('cp1252', 'cp1251', 'cp1250', 'cp1253', 'cp1254', 'cp1257', 'cp1255', 'cp1256')
+ENCODING_CHAOS_MARGIN = 0.15  # Matches this much noisier than the cleanest still count as clean
+ENCODING_COHERENCE_MARGIN = 0.1  # ...and this much less language-coherent than the best
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read per update when a file isn't mapped
+MMAP_MIN_SIZE = 1024 * 1024  # Smaller files are hashed with plain reads
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", str((os.cpu_count() or 1) * 2)))  # Hash/extract threads
+# Hash/extract in this many worker processes instead of threads, for CPU-bound extractors that
+# hold the GIL; 0 (the default) uses SCAN_WORKERS threads
+SCAN_PROCESSES = int(os.getenv("SCAN_PROCESSES", "0"))
+# Files of no known type have nothing to extract and are recorded from their stat alone;
+# set HASH_UNKNOWN_FILES=1 to still hash them so they show up in duplicate detection
+HASH_UNKNOWN_FILES = os.getenv("HASH_UNKNOWN_FILES", "0") == "1"
+SKIPPED_DIR_NAMES = frozenset({'system volume information', '$recycle.bin', 'thumbs.db'})  # Lower-cased
+WORD_RE = re.compile(r"[^\W_]+")  # Runs of letters and digits; '_', '-', '.' and '/' separate words
+LONG_WORD_RE = re.compile(r"[^\W_]{3,}")  # Content and path words shorter than 3 aren't indexed
+# Sub-tokens of camelCase, PascalCase and letter/digit identifiers ("HTTPServer2" -> HTTP, Server, 2)
+IDENTIFIER_PART_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+# Common English words left out of the content and path indexes; they match nearly every
+# text document, so their posting lists are large and useless as search terms
+STOP_WORDS = frozenset({
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'were', 'but', 'not',
+    'you', 'your', 'all', 'any', 'can', 'has', 'have', 'had', 'its', 'our', 'they', 'their',
+    'them', 'there', 'then', 'than', 'which', 'who', 'will', 'would', 'been', 'into', 'also',
+    'about', 'these', 'those', 'such', 'each', 'other', 'more', 'most', 'some', 'what', 'when',
+    'where', 'how', 'his', 'her', 'she', 'him', 'one', 'out', 'use', 'may', 'should', 'could',
+})
+
+# File classification by lower-cased extension
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'})
+TEXT_EXTENSIONS = frozenset({'.txt', '.md', '.csv', '.json', '.xml', '.log', '.py', '.js', '.html', '.css', '.c', '.cpp', '.java'})
+DOCUMENT_EXTENSIONS = frozenset({'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.rtf', '.odt'})
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v'})
+AUDIO_EXTENSIONS = frozenset({'.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a'})
+OCR_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.pdf'})  # Sent to ocr_file
+# Extension -> file type in one lookup; built in reverse precedence so earlier types win overlaps
+FILE_TYPES_BY_EXTENSION = {
+    ext: file_type
+    for file_type, extensions in (("audio", AUDIO_EXTENSIONS), ("video", VIDEO_EXTENSIONS),
+                                  ("text", TEXT_EXTENSIONS), ("document", DOCUMENT_EXTENSIONS),
+                                  ("image", IMAGE_EXTENSIONS))
+    for ext in extensions
+}
+
+_EMBEDDER = None  # Loaded sentence-transformers model; False once loading has failed
+_EMBEDDER_LOCK = threading.Lock()
+
+# Stored hashes are tagged "<algorithm>:<hex digest>", so a record or cache entry hashed
+# before an optional hashing package was installed or removed is never mistaken for a match
+HASH_ALGORITHM = "blake3" if blake3 is not None else "xxh3_128" if xxhash is not None else "sha256"
+
+def new_content_hasher():
+    """A hasher for calculate_hash: BLAKE3 when installed, else XXH3-128, else SHA256."""
+    if blake3 is not None:
+        return blake3.blake3()
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.sha256()
+
+def content_digest(hasher) -> str:
+    """The stored form of a new_content_hasher digest, tagged with HASH_ALGORITHM."""
+    return f"{HASH_ALGORITHM}:{hasher.hexdigest()}"
 
 def calculate_hash(filepath: str) -> str:
-    """Calculates the SHA256 hash of a file for duplicate detection."""
-    hasher = hashlib.sha256()
+    """Calculates a content hash of a file for duplicate detection.
+
+    Uses BLAKE3 when installed, else XXH3-128, else SHA256 (dedup only, not security).
+    """
     try:
-        with open(filepath, 'rb') as file:
+        hasher = new_content_hasher()
+        with open(filepath, 'rb', buffering=0) as file:
+            # Hashing a mapped file is one C-level update (OpenSSL uses SHA-NI where the CPU
+            # has it) with no Python loop and no copies into a read buffer. Below
+            # MMAP_MIN_SIZE the mapping setup costs more than the one or two reads it saves
+            if os.fstat(file.fileno()).st_size >= MMAP_MIN_SIZE:
+                try:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                            mapped.madvise(mmap.MADV_SEQUENTIAL)  # Aggressive kernel read-ahead
+                        hasher.update(mapped)
+                    return content_digest(hasher)
+                except (ValueError, OSError):
+                    pass  # Some pipes and network mounts can't be mapped
+            
+            # Large unbuffered reads into one reused buffer keep the Python loop short
+            buffer = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buffer)
             while True:
-                chunk = file.read(4096)
-                if not chunk:
+                read = file.readinto(buffer)
+                if not read:
                     break
-                hasher.update(chunk)
-        return hasher.hexdigest()
+                hasher.update(view[:read])
+        return content_digest(hasher)
     except Exception as e:
         print(f"Error calculating hash for {filepath}: {e}")
         return ""
 
+def read_small_file(filepath: str, stat: os.stat_result) -> Optional[bytes]:
+    """Whole contents of a file of at most SMALL_FILE_SIZE bytes, else None without reading it."""
+    if stat.st_size > SMALL_FILE_SIZE:
+        return None
+    with open(filepath, 'rb', buffering=0) as file:
+        content = file.read(SMALL_FILE_SIZE + 1)
+    # A file that changed size since the stat is hashed the normal way instead
+    return content if len(content) == stat.st_size else None
+
+def stat_signature(stat: os.stat_result) -> str:
+    """A file's fingerprint: its size and mtime, computable without opening the file."""
+    return f"{stat.st_size:x}:{stat.st_mtime_ns:x}"
+
 def normalize_path(path: str) -> str:
     """Normalize paths for cross-platform compatibility."""
     return os.path.normpath(os.path.abspath(path))
 
+def file_extension(filepath: str) -> str:
+    """Lower-cased extension of a path, including the dot."""
+    return os.path.splitext(filepath)[1].lower()
+
 def is_image_file(filepath: str) -> bool:
     """Check if file is an image based on extension."""
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
-    return os.path.splitext(filepath)[1].lower() in image_extensions
+    return file_extension(filepath) in IMAGE_EXTENSIONS
 
 def is_text_file(filepath: str) -> bool:
     """Check if file is a text file based on extension."""
-    text_extensions = {'.txt', '.md', '.csv', '.json', '.xml', '.log', '.py', '.js', '.html', '.css', '.c', '.cpp', '.java'}
-    return os.path.splitext(filepath)[1].lower() in text_extensions
+    return file_extension(filepath) in TEXT_EXTENSIONS
 
 def is_document_file(filepath: str) -> bool:
     """Check if file is a document based on extension."""
-    doc_extensions = {'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.rtf', '.odt'}
-    return os.path.splitext(filepath)[1].lower() in doc_extensions
+    return file_extension(filepath) in DOCUMENT_EXTENSIONS
 
 def is_video_file(filepath: str) -> bool:
     """Check if file is a video based on extension."""
-    video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm', '.m4v'}
-    return os.path.splitext(filepath)[1].lower() in video_extensions
+    return file_extension(filepath) in VIDEO_EXTENSIONS
 
 def is_audio_file(filepath: str) -> bool:
     """Check if file is audio based on extension."""
-    audio_extensions = {'.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a'}
-    return os.path.splitext(filepath)[1].lower() in audio_extensions
+    return file_extension(filepath) in AUDIO_EXTENSIONS
+
+def utf16_without_bom(raw: bytes) -> Optional[str]:
+    """'utf-16-le' or 'utf-16-be' when NUL bytes fill alternate positions of `raw`, else None.
+
+    Text in Latin scripts saved as UTF-16 has a zero high byte in nearly every code unit, and
+    real text in any single-byte or UTF-8 encoding has no NULs at all.
+    """
+    half = len(raw) // 2
+    if half < 2:
+        return None
+    even_nuls, odd_nuls = raw[0:2 * half:2].count(0), raw[1:2 * half:2].count(0)
+    if odd_nuls >= half * 0.3 and even_nuls <= half * 0.05:
+        return 'utf-16-le'
+    if even_nuls >= half * 0.3 and odd_nuls <= half * 0.05:
+        return 'utf-16-be'
+    return None
+
+def detect_legacy_encoding(raw: bytes) -> Optional[str]:
+    """Picks a single- or multi-byte encoding for non-UTF text with charset_normalizer.
 
-def extract_text_content(filepath: str) -> str:
-    """Extract text content from various file types."""
-    _, ext = os.path.splitext(filepath)
-    ext = ext.lower()
+    On short text many code pages decode without any chaos, and the detector's first pick is
+    often an obscure one (cp1006 for "café crème"), so among the matches that are about as
+    clean and as language-coherent as the best, the most common Windows code page wins.
+    """
+    matches = list(charset_normalizer.from_bytes(raw))
+    if not matches:
+        return None
+    least_chaos = min(match.chaos for match in matches)
+    candidates = [match for match in matches if match.chaos <= least_chaos + ENCODING_CHAOS_MARGIN]
+    best_coherence = max(match.coherence for match in candidates)
+    candidates = [match for match in candidates if match.coherence >= best_coherence - ENCODING_COHERENCE_MARGIN]
+    for encoding in PREFERRED_ENCODINGS:
+        for match in candidates:
+            if encoding == match.encoding or encoding in match.could_be_from_charset:
+                return encoding
+    return candidates[0].encoding
+
+def decode_text_sample(raw: bytes, truncated: bool = False) -> str:
+    """Decodes the leading bytes of a text file, detecting its encoding from those bytes.
+
+    BOM-marked UTF-16/32, BOM-less UTF-16 and UTF-8 (the common case) are decoded directly.
+    Anything else goes to charset_normalizer when installed; without it, or when it finds
+    nothing, Windows-1252 (Western European text) and finally latin-1, which accepts any bytes.
+    `truncated` means the file goes on past `raw`, which may then end mid-character.
+    """
+    for bom, encoding in ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+                          (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'),
+                          (codecs.BOM_UTF16_BE, 'utf-16')):
+        if raw.startswith(bom):
+            return codecs.getincrementaldecoder(encoding)(errors='replace').decode(raw, not truncated)
+    # Checked before UTF-8, which accepts NUL bytes
+    encoding = utf16_without_bom(raw)
+    if encoding is not None:
+        return codecs.getincrementaldecoder(encoding)(errors='replace').decode(raw, not truncated)
+    try:
+        # Not final for a partial read, so a character cut off at the end isn't an error
+        return codecs.getincrementaldecoder('utf-8')().decode(raw, not truncated)
+    except UnicodeDecodeError:
+        pass
+    if charset_normalizer is not None:
+        encoding = detect_legacy_encoding(raw)
+        if encoding is not None:
+            return raw.decode(encoding, errors='replace')
+    try:
+        return raw.decode('cp1252')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+def extract_text_content(filepath: str, ext: Optional[str] = None) -> str:
+    """Extract text content from various file types (`ext` as from file_extension, if known)."""
+    if ext is None:
+        ext = file_extension(filepath)
     
     # Try OCR for images and PDFs
-    if ext in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.pdf']:
+    if ext in OCR_EXTENSIONS:
         return ocr_file(filepath)
     
     # Direct text extraction for text files
-    elif is_text_file(filepath):
+    elif ext in TEXT_EXTENSIONS:
         try:
-            # Try different encodings for better compatibility
-            encodings = ['utf-8', 'utf-16', 'latin-1', 'cp1252']
-            for encoding in encodings:
-                try:
-                    with open(filepath, 'r', encoding=encoding) as f:
-                        content = f.read(2000)  # First 2000 chars
-                        return content
-                except UnicodeDecodeError:
-                    continue
-            return ""  # If all encodings fail
+            with open(filepath, 'rb', buffering=0) as f:
+                raw = f.read(TEXT_SAMPLE_BYTES)
+            # Universal newlines, as text-mode reads gave
+            text = decode_text_sample(raw, len(raw) == TEXT_SAMPLE_BYTES).replace('\r\n', '\n').replace('\r', '\n')
+            return text[:TEXT_PREVIEW_CHARS]
         except Exception as e:
             print(f"Error reading text file {filepath}: {e}")
             return ""
     
     return ""
 
-def generate_embeddings(text: str) -> List[float]:
+def get_embedding_model():
+    """Loads the EMBEDDING_MODEL sentence-transformers model on first use.
+
+    Returns None when sentence-transformers isn't installed or the model can't be loaded.
+    """
+    global _EMBEDDER
+    if SentenceTransformer is None:
+        return None
+    with _EMBEDDER_LOCK:
+        if _EMBEDDER is None:
+            try:
+                _EMBEDDER = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+            except Exception as e:
+                print(f"Error loading embedding model {EMBEDDING_MODEL}, using hash embeddings: {e}")
+                _EMBEDDER = False
+    return _EMBEDDER or None
+
+def embedding_model_name() -> str:
+    """Names whatever generate_embeddings currently uses, for tagging cached vectors."""
+    return EMBEDDING_MODEL if get_embedding_model() is not None else HASH_EMBEDDING_MODEL
+
+def hash_embedding(text: str) -> np.ndarray:
+    """Deterministic stand-in embedding derived from an MD5 of the text (no semantics)."""
+    digest = hashlib.md5(text.lower().encode(), usedforsecurity=False).digest()
+    
+    # Repeat the digest bytes to the desired dimension and scale them to 0-1
+    embedding = np.resize(np.frombuffer(digest, dtype=np.uint8), EMBEDDING_DIMENSION)
+    return embedding.astype(np.float32) * np.float32(1 / 255.0)
+
+def generate_embeddings(text: str) -> np.ndarray:
     """Generate embedding vector for text content."""
-    # Simplified embedding generation - in a real app, use sentence-transformers or OpenAI
     if not text:
-        return [0.0] * 384  # Return zero vector for empty text
-    
-    # Simple hash-based embedding for demo purposes
-    # In production, use actual embedding models
-    import hashlib
-    text_hash = hashlib.md5(text.lower().encode()).hexdigest()
-    
-    # Convert hash to numeric vector
-    embedding = []
-    for i in range(0, len(text_hash), 2):
-        hex_pair = text_hash[i:i+2]
-        embedding.append(int(hex_pair, 16) / 255.0)  # Normalize to 0-1
-    
-    # Pad or truncate to desired dimension
-    while len(embedding) < 384:
-        embedding.extend(embedding[:384-len(embedding)])
-    
-    return embedding[:384]
+        return ZERO_EMBEDDING
+    return generate_embeddings_batch([text])[0]
 
-def determine_file_type(filepath: str) -> str:
-    """Determine file type based on extension."""
-    if is_image_file(filepath):
-        return "image"
-    elif is_document_file(filepath):
-        return "document"
-    elif is_text_file(filepath):
-        return "text"
-    elif is_video_file(filepath):
-        return "video"
-    elif is_audio_file(filepath):
-        return "audio"
+def generate_embeddings_batch(texts: List[str]) -> np.ndarray:
+    """Embeds many texts at once, returning a float32 (len(texts), EMBEDDING_DIMENSION) array.
+
+    Uses the sentence-transformers model in EMBEDDING_BATCH_SIZE forward passes when it is
+    available, else hash embeddings. Empty texts get zero vectors.
+    """
+    embeddings = np.zeros((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+    rows = [i for i, text in enumerate(texts) if text]
+    if not rows:
+        return embeddings
+    
+    model = get_embedding_model()
+    if model is not None:
+        embeddings[rows] = model.encode(
+            [texts[i] for i in rows], batch_size=EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True, normalize_embeddings=True
+        )
     else:
-        return "unknown"
+        for i in rows:
+            embeddings[i] = hash_embedding(texts[i])
+    return embeddings
 
-def process_file_content(filepath: str) -> Dict[str, Any]:
-    """Enhanced content processing with better search indexing."""
+def determine_file_type(filepath: str, ext: Optional[str] = None) -> str:
+    """Determine file type based on extension (`ext` as from file_extension, if known)."""
+    if ext is None:
+        ext = file_extension(filepath)
+    return FILE_TYPES_BY_EXTENSION.get(ext, "unknown")
+
+def extract_file_content(filepath: str, content_hash: Optional[str] = None,
+                         ext: Optional[str] = None, embedding_model: Optional[str] = None,
+                         defer_embedding: bool = False) -> Dict[str, Any]:
+    """Extracts text, snippet and embedding for a file (safe to run on worker threads).
+
+    With a content hash, results are served from and stored in the OCR cache; cached
+    embeddings are only used if `embedding_model` (default: embedding_model_name()) made them.
+    With `defer_embedding`, a text that still needs its embedding is returned with
+    embedding_vector None, for the caller to embed in a batch (see embed_in_batches).
+    """
+    if ext is None:
+        ext = file_extension(filepath)
+    if embedding_model is None:
+        embedding_model = embedding_model_name()
     content_data = {
         "text_content": "",
+        "snippet": "",
         "embedding_vector": None,
+        "embedding_model": "",
         "faces_detected": [],
-        "file_type": determine_file_type(filepath)
+        "file_type": determine_file_type(filepath, ext)
     }
     
-    # Extract text content
-    text_content = extract_text_content(filepath)
+    cached = ocr_cache.get(content_hash, embedding_model) if content_hash else None
+    if cached is not None:
+        text_content, embedding_vector = cached
+    else:
+        # Extract text content
+        text_content = extract_text_content(filepath, ext)
+        embedding_vector = None
+    
+    # Generate embeddings if we have any text and the cache had none from this model
+    needs_embedding = bool(text_content) and embedding_vector is None
+    if needs_embedding and not defer_embedding:
+        embedding_vector = generate_embeddings(text_content)
+    
+    # Store new results; a deferred embedding is stored by whoever computes it
+    if content_hash and (cached is None or needs_embedding) and not (needs_embedding and defer_embedding):
+        ocr_cache.put(content_hash, text_content, embedding_vector, embedding_model)
+    
+    # The short snippet is what search results display
     content_data["text_content"] = text_content
+    content_data["snippet"] = text_content[:SNIPPET_LENGTH]
+    content_data["embedding_vector"] = embedding_vector
+    content_data["embedding_model"] = embedding_model if text_content else ""
     
-    # Generate embeddings if we have text content
-    if text_content:
-        content_data["embedding_vector"] = generate_embeddings(text_content)
+    return content_data
+
+def detect_file_faces(filepath: str, thumbnail: Optional[Tuple[bool, Optional[str]]] = None) -> List[int]:
+    """Detects and clusters the faces in an image, returning their cluster ids.
+
+    Clustering updates the shared face database, so this runs on the scanning thread.
+    `thumbnail` is the image's thumbnail_batch() result, if there is one.
+    """
+    try:
+        faces_data = detect_and_encode_faces(filepath, thumbnail)
+        if faces_data:
+            return cluster_faces(faces_data)
+    except Exception as e:
+        print(f"Error processing faces in {filepath}: {e}")
+    return []
+
+def process_file_content(filepath: str, thumbnail: Optional[Tuple[bool, Optional[str]]] = None) -> Dict[str, Any]:
+    """Enhanced content processing with better search indexing."""
+    content_data = extract_file_content(filepath)
     
     # Process images for face detection
     if is_image_file(filepath):
+        content_data["faces_detected"] = detect_file_faces(filepath, thumbnail)
+    
+    return content_data
+
+def build_file_record(filepath: str, filename: str, previous: Optional[Dict[str, Any]] = None,
+                      entry: Optional[os.DirEntry] = None, ext: Optional[str] = None,
+                      embedding_model: Optional[str] = None, defer_embedding: bool = False) -> Dict[str, Any]:
+    """Stats, hashes and extracts content for one file; faces are added by the caller.
+
+    If `previous` (the file's record from the last scan) has the same size and mtime, its
+    hash and text are reused instead of being recomputed, and its embedding too if
+    `embedding_model` (default: embedding_model_name()) made it. `entry` is the file's scandir
+    entry, whose stat is cached (and free on Windows); `ext` is its file_extension, if known.
+    `embedding_model` and `defer_embedding` are passed to extract_file_content.
+    """
+    # Collect basic metadata
+    stat = entry.stat() if entry is not None else os.stat(filepath)
+    if ext is None:
+        ext = file_extension(filename)
+    if embedding_model is None:
+        embedding_model = embedding_model_name()
+    
+    file_record = {
+        # walk_files entries under a normalized root already have normalized paths
+        "path": filepath if entry is not None else normalize_path(filepath),
+        "filename": filename,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "fingerprint": "",
+        "hash": "",
+        "indexed": False,
+        "file_type": "unknown",
+        "text_content": "",
+        "snippet": "",
+        "embedding_vector": None,
+        "embedding_model": "",  # What made embedding_vector; vectors of different models don't compare
+        "faces_detected": []
+    }
+    
+    # Unknown types are skipped before any read (see HASH_UNKNOWN_FILES)
+    if ext not in FILE_TYPES_BY_EXTENSION and not HASH_UNKNOWN_FILES:
+        return file_record
+    
+    # Only process non-empty files
+    if file_record["size"] > 0 and file_record["size"] < 100 * 1024 * 1024:  # Skip files larger than 100MB
         try:
-            faces_data = detect_and_encode_faces(filepath)
-            if faces_data:
-                cluster_ids = cluster_faces(faces_data)
-                content_data["faces_detected"] = cluster_ids
+            # Same size and mtime as the last scan is trusted without reading the file at all,
+            # as long as the stored hash came from the algorithm in use now
+            file_record["fingerprint"] = stat_signature(stat)
+            if (previous and previous.get("indexed")
+                    and previous.get("fingerprint") == file_record["fingerprint"]
+                    and previous.get("hash", "").startswith(HASH_ALGORITHM + ":")):
+                # Unchanged since the last scan; faces are re-detected since clusters aren't persisted
+                file_record.update({key: value for key, value in previous.items()
+                                    if key not in ("faces_detected", "fingerprint")})
+                if file_record["text_content"] and file_record["embedding_model"] != embedding_model:
+                    # Embedded by another model: the text stands, the vector must come from this one
+                    cached = ocr_cache.get(file_record["hash"], embedding_model)
+                    file_record["embedding_vector"] = cached[1] if cached is not None else None
+                    file_record["embedding_model"] = embedding_model
+                    if file_record["embedding_vector"] is None and not defer_embedding:
+                        file_record["embedding_vector"] = generate_embeddings(file_record["text_content"])
+                        ocr_cache.put(file_record["hash"], file_record["text_content"],
+                                      file_record["embedding_vector"], embedding_model)
+                return file_record
+            
+            # Small files are hashed from a single read, which extraction then finds in the page cache
+            content = read_small_file(filepath, stat)
+            if content is not None:
+                hasher = new_content_hasher()
+                hasher.update(content)
+                file_record["hash"] = content_digest(hasher)
+            else:
+                file_record["hash"] = calculate_hash(filepath)
+            if file_record["hash"]:
+                file_record.update(extract_file_content(
+                    filepath, file_record["hash"], ext, embedding_model, defer_embedding
+                ))
+                file_record["indexed"] = True
         except Exception as e:
-            print(f"Error processing faces in {filepath}: {e}")
+            print(f"Error processing {filepath}: {e}")
     
-    return content_data
+    return file_record
 
-def build_search_index(records: List[Dict[str, Any]]):
-    """Build an in-memory search index for faster searching."""
+def encode_postings(indices: Iterable[int]) -> np.ndarray:
+    """Gap-encodes record indices: sorted deltas in the narrowest unsigned dtype that fits.
+
+    Dense lists have small gaps, so most posting lists take one or two bytes per record.
+    """
+    postings = np.fromiter(sorted(indices), dtype=np.int64)
+    gaps = np.diff(postings, prepend=0)
+    largest = gaps.max(initial=0)
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if largest <= np.iinfo(dtype).max:
+            return gaps.astype(dtype)
+    return gaps
+
+def decode_postings(gaps: np.ndarray) -> np.ndarray:
+    """Record indices of a posting list made by encode_postings."""
+    return np.cumsum(gaps, dtype=np.int64)
+
+def split_identifier(word: str) -> List[str]:
+    """Lowercased sub-tokens of an identifier-style word, e.g. searchContent -> search, content."""
+    return [part.lower() for part in IDENTIFIER_PART_RE.findall(word)]
+
+def has_identifier_parts(word: str) -> bool:
+    """Only ASCII words mixing case or letters and digits have sub-tokens worth indexing."""
+    return word.isascii() and not (word.isalpha() and (word.islower() or word.isupper()))
+
+def index_words(text: str, word_re: re.Pattern, min_length: int = 1) -> set:
+    """Distinct lowercased words of `text`, plus the sub-tokens of identifier-style words."""
+    words = set()
+    for word in set(word_re.findall(text)):
+        words.add(word.lower())
+        if has_identifier_parts(word):
+            words.update(part for part in split_identifier(word) if len(part) >= min_length)
+    return words
+
+def identifier_parts(text: str) -> set:
+    """Sub-tokens of the identifier-style words in `text`, for indexes that don't split on case."""
+    parts = set()
+    for word in set(WORD_RE.findall(text)):
+        if has_identifier_parts(word):
+            parts.update(split_identifier(word))
+    return parts
+
+def build_search_index(records: Iterable[Dict[str, Any]]):
+    """Build an in-memory search index for faster searching.
+
+    `records` is consumed in a single pass, so it can stream from the index store. Only what
+    semantic search needs is built here; the keyword maps are built on the first keyword
+    search_files() call (see keyword_index), since the API sends keyword queries to FTS5.
+    """
     global SEARCH_INDEX
+    # Results display the snippet, so full text stays out; embeddings move into the matrix below
+    all_records = []
+    
+    # Unit-length embeddings stacked row-wise and quantized to int8 (a quarter of float32), so
+    # semantic search is a blocked matrix-vector product; embedding_rows maps each matrix row
+    # back to its record index
+    embedding_rows = []
+    embedding_list = []
+    
+    for i, record in enumerate(records):
+        all_records.append(
+            {key: value for key, value in record.items() if key not in ('text_content', 'embedding_vector')}
+        )
+        if record.get('embedding_vector') is not None:
+            embedding_rows.append(i)
+            embedding_list.append(record['embedding_vector'])
+    
+    embeddings = np.array(embedding_list, dtype=np.float32).reshape(len(embedding_list), EMBEDDING_DIMENSION)
+    del embedding_list
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0  # Zero vectors stay zero and never pass the similarity threshold
+    embeddings /= norms
+    
+    # Symmetric per-row scales map each row's largest component to +/-127; a unit vector's
+    # components are far below 1, so one shared scale would leave only a few int8 levels
+    scales = np.abs(embeddings).max(axis=1, initial=0.0) / EMBEDDING_QUANT_LEVELS
+    scales[scales == 0] = 1.0
+    embeddings = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    
     SEARCH_INDEX = {
-        'by_filename': {},
-        'by_content': {},
-        'by_path': {},
-        'by_type': {},
-        'all_records': records
+        'all_records': all_records,
+        'embeddings': embeddings,
+        'embedding_scales': scales.astype(np.float32),
+        'embedding_rows': np.array(embedding_rows, dtype=np.int64)
     }
-    
+
+def build_keyword_index(records: Iterable[Dict[str, Any]],
+                        rows: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Builds the word posting maps, vocabulary and trigram map over `records` in one pass.
+
+    Postings hold each record's position in `records`, or its row from `rows` (path -> index
+    into all_records) when given; records whose path isn't in `rows` are skipped.
+    """
+    # Posting lists are collected as sets (repeated words add nothing) and frozen to
+    # gap-encoded arrays (see encode_postings), a fraction of the memory of lists of Python
+    # ints. Words are interned as they are frozen, so a word in several maps and the
+    # vocabulary is stored once
+    by_filename, by_content, by_path, by_type = (defaultdict(set) for _ in range(4))
     for i, record in enumerate(records):
-        filename = record.get('filename', '').lower()
-        content = record.get('text_content', '').lower()
-        path = record.get('path', '').lower()
-        file_type = record.get('file_type', 'unknown')
+        if rows is not None:
+            i = rows.get(record.get('path'))
+            if i is None:
+                continue
         
+        # Words are split on case before lowercasing, so a query for "content" hits
+        # searchContent.py through the posting maps rather than the partial-match path
         # Index by filename words
-        for word in filename.replace('_', ' ').replace('-', ' ').split():
-            if word not in SEARCH_INDEX['by_filename']:
-                SEARCH_INDEX['by_filename'][word] = []
-            SEARCH_INDEX['by_filename'][word].append(i)
+        for word in index_words(record.get('filename', ''), WORD_RE):
+            by_filename[word].add(i)
         
         # Index by content words
-        for word in content.split():
-            if len(word) > 2:  # Skip very short words
-                if word not in SEARCH_INDEX['by_content']:
-                    SEARCH_INDEX['by_content'][word] = []
-                SEARCH_INDEX['by_content'][word].append(i)
+        for word in index_words(record.get('text_content', ''), LONG_WORD_RE, 3) - STOP_WORDS:
+            by_content[word].add(i)
         
         # Index by path components
-        path_normalized = path.replace('\\', '/').replace('_', ' ').replace('-', ' ')
-        for word in path_normalized.split('/'):
-            if word and len(word) > 2:
-                if word not in SEARCH_INDEX['by_path']:
-                    SEARCH_INDEX['by_path'][word] = []
-                SEARCH_INDEX['by_path'][word].append(i)
+        for word in index_words(record.get('path', ''), LONG_WORD_RE, 3) - STOP_WORDS:
+            by_path[word].add(i)
         
         # Index by file type
-        if file_type not in SEARCH_INDEX['by_type']:
-            SEARCH_INDEX['by_type'][file_type] = []
-        SEARCH_INDEX['by_type'][file_type].append(i)
+        by_type[record.get('file_type', 'unknown')].add(i)
+    
+    keyword_maps = {}
+    for key, postings in (('by_filename', by_filename), ('by_content', by_content),
+                          ('by_path', by_path), ('by_type', by_type)):
+        keyword_maps[key] = {
+            sys.intern(word): encode_postings(indices)
+            for word, indices in postings.items()
+        }
+    
+    # Sorted vocabulary plus a character-trigram map over it, so partial matches probe a few
+    # candidate words instead of scanning every indexed word
+    vocabulary = sorted(keyword_maps['by_filename'].keys() | keyword_maps['by_content'].keys())
+    trigrams = defaultdict(list)
+    for word_id, word in enumerate(vocabulary):
+        for trigram in {word[k:k + 3] for k in range(len(word) - 2)}:
+            trigrams[trigram].append(word_id)
+    keyword_maps['vocabulary'] = vocabulary
+    keyword_maps['trigrams'] = {
+        trigram: np.array(word_ids, dtype=np.int32) for trigram, word_ids in trigrams.items()
+    }
+    return keyword_maps
 
-def scan_directory(scan_paths: List[str]) -> List[Dict[str, Any]]:
-    """Enhanced directory scanning with better error handling and progress tracking."""
-    index_data = []
-    total_files = 0
+def keyword_index(search_index: Dict[str, Any]) -> Dict[str, Any]:
+    """Adds the keyword maps to `search_index` on first use, streaming text from the index store."""
+    with _KEYWORD_INDEX_LOCK:
+        if 'by_filename' not in search_index:
+            rows = {record['path']: i for i, record in enumerate(search_index['all_records'])}
+            search_index.update(build_keyword_index(index_store.iter_records(), rows))
+    return search_index
+
+def words_containing(search_index: Dict[str, Any], word: str) -> List[str]:
+    """Indexed filename/content words that contain `word`.
+
+    Words shorter than a trigram are matched by prefix instead of anywhere inside.
+    """
+    vocabulary = search_index['vocabulary']
+    if len(word) < 3:
+        matches = []
+        for j in range(bisect_left(vocabulary, word), len(vocabulary)):
+            if not vocabulary[j].startswith(word):
+                break
+            matches.append(vocabulary[j])
+        return matches
+    
+    # Every trigram of the word must occur in a match; verify candidates of the rarest one
+    candidates = None
+    for trigram in {word[k:k + 3] for k in range(len(word) - 2)}:
+        word_ids = search_index['trigrams'].get(trigram)
+        if word_ids is None:
+            return []
+        if candidates is None or len(word_ids) < len(candidates):
+            candidates = word_ids
+    return [vocabulary[j] for j in candidates.tolist() if word in vocabulary[j]]
+
+def walk_files(root_path: str) -> Iterator[Tuple[str, List[os.DirEntry]]]:
+    """Yields (directory, file entries) top-down like os.walk, skipping hidden and system entries.
+
+    Built on os.scandir so callers get each file's DirEntry instead of re-statting its path.
+    Symlinked directories are listed by os.walk but not entered, so they are skipped here.
+    """
+    stack = [root_path]
+    while stack:
+        directory = stack.pop()
+        files = []
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if not entry.is_symlink() and entry.name.lower() not in SKIPPED_DIR_NAMES:
+                            subdirectories.append(entry.path)
+                    elif entry.name != INDEX_FILE:
+                        files.append(entry)
+        except OSError as e:
+            print(f"Error reading directory {directory}: {e}")
+            continue
+        yield directory, files
+        stack.extend(reversed(subdirectories))  # Visit subdirectories in listing order
+
+def _needs_embedding(record: Dict[str, Any]) -> bool:
+    return bool(record["indexed"] and record["text_content"]) and record["embedding_vector"] is None
+
+def _embed_waiting(records: List[Dict[str, Any]], embedding_model: str):
+    """Embeds the records still missing a vector in one batch and caches the results."""
+    waiting = [record for record in records if _needs_embedding(record)]
+    if not waiting:
+        return
+    vectors = generate_embeddings_batch([record["text_content"] for record in waiting])
+    for record, vector in zip(waiting, vectors):
+        record["embedding_vector"] = vector
+        if record["hash"]:
+            ocr_cache.put(record["hash"], record["text_content"], vector, embedding_model)
+
+def embed_in_batches(records: Iterable[Dict[str, Any]], embedding_model: str) -> Iterator[Dict[str, Any]]:
+    """Passes records through in order, filling in deferred embeddings a batch at a time.
+
+    Records are held until EMBEDDING_BATCH_SIZE of them need embedding (or a bounded number
+    have piled up), so the model runs full batches instead of one text per call.
+    """
+    held = []
+    waiting = 0
+    for record in records:
+        held.append(record)
+        if _needs_embedding(record):
+            waiting += 1
+        if waiting >= EMBEDDING_BATCH_SIZE or len(held) >= EMBEDDING_BATCH_SIZE * 8:
+            _embed_waiting(held, embedding_model)
+            yield from held
+            held = []
+            waiting = 0
+    _embed_waiting(held, embedding_model)
+    yield from held
+
+def iter_scan(scan_paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Scans the given folders, yielding each file's record in walk order as it is finished.
+
+    Nothing is accumulated here, so memory stays flat however large the tree; pass the
+    generator to save_index() to stream the records into the index store.
+    """
+    embedding_model = embedding_model_name()
+    # A real model is far faster on batches, so workers leave embedding to this thread then
+    batched = embedding_model != HASH_EMBEDDING_MODEL
+    records = _scan_records(scan_paths, embedding_model, batched)
+    return embed_in_batches(records, embedding_model) if batched else records
+
+def _scan_records(scan_paths: List[str], embedding_model: str, defer_embedding: bool) -> Iterator[Dict[str, Any]]:
+    seen_files = 0  # Counted as the walk goes; there is no separate counting pass
     processed_files = 0
+    indexed_files = 0
     
     print(f"OS Platform: {platform.system()}")
     print(f"Python version: {platform.python_version()}")
@@ -213,189 +773,228 @@ def scan_directory(scan_paths: List[str]) -> List[Dict[str, Any]]:
     
     if not valid_paths:
         print("Error: No valid scan paths found!")
-        return []
+        return
     
-    # Count total files first
-    for root_path in valid_paths:
+    # Hashing and text extraction run on worker threads (file reads and hashing release the
+    # GIL) or, with SCAN_PROCESSES set, worker processes; records are finished in walk order
+    # on this thread, which also clusters faces
+    pending = deque()  # (filepath, thumbnail, future) in submission order
+    
+    def finish_oldest() -> Optional[Dict[str, Any]]:
+        nonlocal processed_files, indexed_files
+        filepath, thumbnail, future = pending.popleft()
+        processed_files += 1
+        
+        # Progress indicator
+        if processed_files % 100 == 0:
+            print(f"Progress: {processed_files} processed / {seen_files} seen")
+        
         try:
-            for root, dirs, files in os.walk(root_path):
-                # Filter out hidden directories and system directories
-                dirs[:] = [d for d in dirs if not d.startswith('.') and d.lower() not in ['system volume information', '$recycle.bin', 'thumbs.db']]
-                total_files += len([f for f in files if not f.startswith('.') and f != INDEX_FILE])
+            file_record = future.result()
         except Exception as e:
-            print(f"Error counting files in {root_path}: {e}")
+            print(f"Error accessing {filepath}: {e}")
+            return None
+        if file_record["indexed"]:
+            indexed_files += 1
+            if file_record["file_type"] == "image":
+                file_record["faces_detected"] = detect_file_faces(filepath, thumbnail)
+        return file_record
     
-    print(f"Found {total_files} files to process")
+    if SCAN_PROCESSES > 0:
+        executor, workers = ProcessPoolExecutor(max_workers=SCAN_PROCESSES), SCAN_PROCESSES
+    else:
+        executor, workers = ThreadPoolExecutor(max_workers=SCAN_WORKERS), SCAN_WORKERS
     
-    for root_path in valid_paths:
-        print(f"Scanning directory: {root_path}")
-        
-        try:
-            for root, dirs, files in os.walk(root_path):
-                # Filter out hidden and system directories
-                dirs[:] = [d for d in dirs if not d.startswith('.') and d.lower() not in ['system volume information', '$recycle.bin']]
-                
-                for file in files:
-                    if file.startswith('.') or file == INDEX_FILE:
-                        continue
-                    
-                    processed_files += 1
-                    filepath = os.path.join(root, file)
+    with executor:
+        for root_path in valid_paths:
+            print(f"Scanning directory: {root_path}")
+            
+            try:
+                for _, files in walk_files(root_path):
+                    # Each name's extension is split once, for the thumbnail filter and the worker
+                    extensions = [file_extension(entry.name) for entry in files]
                     
-                    # Progress indicator
-                    if processed_files % 100 == 0:
-                        print(f"Progress: {processed_files}/{total_files} files processed ({(processed_files/total_files)*100:.1f}%)")
+                    # Thumbnail this folder's images in parallel up front; face detection reuses them
+                    thumbnails = thumbnail_batch([
+                        entry.path for entry, ext in zip(files, extensions) if ext in IMAGE_EXTENSIONS
+                    ])
                     
-                    try:
-                        # Collect basic metadata
-                        stat = os.stat(filepath)
-                        
-                        file_record = {
-                            "path": normalize_path(filepath),
-                            "filename": file,
-                            "size": stat.st_size,
-                            "mtime": stat.st_mtime,
-                            "hash": "",
-                            "indexed": False,
-                            "file_type": "unknown",
-                            "text_content": "",
-                            "embedding_vector": None,
-                            "faces_detected": []
-                        }
-                        
-                        # Only process non-empty files
-                        if file_record["size"] > 0 and file_record["size"] < 100 * 1024 * 1024:  # Skip files larger than 100MB
-                            try:
-                                file_record["hash"] = calculate_hash(filepath)
-                                if file_record["hash"]:
-                                    content_data = process_file_content(filepath)
-                                    file_record.update(content_data)
-                                    file_record["indexed"] = True
-                            except Exception as e:
-                                print(f"Error processing {filepath}: {e}")
-                        
-                        index_data.append(file_record)
-                        
-                    except Exception as e:
-                        print(f"Error accessing {filepath}: {e}")
-                        continue
+                    seen_files += len(files)
+                    for entry, ext in zip(files, extensions):
+                        # Scan roots are normalized, so entry paths already are too
+                        filepath = entry.path
+                        # The last scan's record lets an unchanged file skip hashing and extraction;
+                        # the store keeps serving it until a streamed save swaps the new index in
+                        previous = index_store.get(filepath)
+                        # DirEntry objects can't be pickled, so worker processes stat the path
+                        future = executor.submit(
+                            build_file_record, filepath, entry.name, previous,
+                            entry if SCAN_PROCESSES <= 0 else None, ext, embedding_model, defer_embedding
+                        )
+                        pending.append((filepath, thumbnails.get(filepath), future))
                         
-        except Exception as e:
-            print(f"Error walking directory {root_path}: {e}")
-            continue
+                        # Bound the read-ahead so large trees don't queue every file at once
+                        while len(pending) >= workers * 4:
+                            file_record = finish_oldest()
+                            if file_record is not None:
+                                yield file_record
+                            
+            except Exception as e:
+                print(f"Error walking directory {root_path}: {e}")
+                continue
+        
+        while pending:
+            file_record = finish_oldest()
+            if file_record is not None:
+                yield file_record
     
-    print(f"Completed scanning. Processed {processed_files} files, indexed {len([r for r in index_data if r.get('indexed')])} files.")
+    print(f"Completed scanning. Processed {processed_files} files, indexed {indexed_files} files.")
+
+def scan_directory(scan_paths: List[str]) -> List[Dict[str, Any]]:
+    """Enhanced directory scanning with better error handling and progress tracking.
+
+    Collects iter_scan() into a list and rebuilds the search index from it.
+    """
+    index_data = list(iter_scan(scan_paths))
     
-    # Build search index
+    # Build search index; the records may not be in the index store, so keywords are built now too
     build_search_index(index_data)
+    SEARCH_INDEX.update(build_keyword_index(index_data))
     
     return index_data
 
-def save_index(data: List[Dict[str, Any]]):
-    """Saves the index data to a JSON file with better error handling."""
+def save_index(data: Iterable[Dict[str, Any]]):
+    """Saves the index data to the SQLite index store with better error handling.
+
+    `data` may be a generator such as iter_scan(); it is consumed once, record by record.
+    Errors, including those raised by the generator mid-scan, are logged and re-raised; the
+    previous index stays in place.
+    """
     try:
-        # Convert numpy arrays to lists for JSON serialization
-        serializable_data = []
-        for record in data:
-            record_copy = record.copy()
-            if record_copy.get("embedding_vector"):
-                record_copy["embedding_vector"] = list(record_copy["embedding_vector"])
-            serializable_data.append(record_copy)
-        
-        with open(INDEX_FILE, 'w', encoding='utf-8') as f:
-            json.dump(serializable_data, f, indent=2, ensure_ascii=False)
-        print(f"Index saved to {INDEX_FILE}")
-        
-        # Also save a summary
+        # Also save a summary, counted as the records stream past
         summary = {
-            "total_files": len(data),
-            "indexed_files": len([r for r in data if r.get("indexed", False)]),
+            "total_files": 0,
+            "indexed_files": 0,
             "file_types": {}
         }
         
-        for record in data:
-            file_type = record.get("file_type", "unknown")
-            summary["file_types"][file_type] = summary["file_types"].get(file_type, 0) + 1
+        def counted(records):
+            for record in records:
+                summary["total_files"] += 1
+                if record.get("indexed", False):
+                    summary["indexed_files"] += 1
+                file_type = record.get("file_type", "unknown")
+                summary["file_types"][file_type] = summary["file_types"].get(file_type, 0) + 1
+                yield record
         
-        with open("scan_summary.json", 'w', encoding='utf-8') as f:
-            json.dump(summary, f, indent=2)
+        index_store.replace_all(counted(data))
+        print(f"Index saved to {INDEX_FILE}")
+        
+        if orjson is not None:
+            with open("scan_summary.json", 'wb') as f:
+                f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
+        else:
+            with open("scan_summary.json", 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
         
     except Exception as e:
         print(f"Error saving index: {e}")
+        raise
 
 def load_index() -> List[Dict[str, Any]]:
-    """Loads the index data from a JSON file and rebuilds search index."""
-    if os.path.exists(INDEX_FILE):
-        try:
-            with open(INDEX_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-            # Rebuild search index
-            build_search_index(data)
-            return data
-        except Exception as e:
-            print(f"Error loading index: {e}")
+    """Loads the index data from the SQLite index store and rebuilds search index."""
+    try:
+        data = list(index_store.iter_records())
+        # Rebuild search index
+        build_search_index(data)
+        return data
+    except Exception as e:
+        print(f"Error loading index: {e}")
     return []
 
+def refresh_search_index():
+    """Rebuilds the search index by streaming records from the index store."""
+    try:
+        build_search_index(index_store.iter_records())
+    except Exception as e:
+        print(f"Error loading index: {e}")
+
+def get_search_index() -> Dict[str, Any]:
+    """Returns the in-memory search index, loading it from the index store on first use.
+
+    scan_directory() rebuilds the index itself; after streaming iter_scan() into save_index(),
+    call refresh_search_index() so the index isn't left stale.
+    """
+    if not SEARCH_INDEX:
+        refresh_search_index()
+    return SEARCH_INDEX
+
 def search_files(query: str, search_type: str = "keyword") -> List[Dict[str, Any]]:
     """Enhanced search function with better matching."""
-    if not SEARCH_INDEX:
+    search_index = get_search_index()
+    if not search_index.get('all_records'):
         print("Search index not loaded")
         return []
     
     query_lower = query.lower()
-    matching_indices = set()
+    matching_indices = []
     
     if search_type == "keyword":
+        search_index = keyword_index(search_index)
         # Search in filename, content, and path
-        query_words = query_lower.replace('_', ' ').replace('-', ' ').split()
+        query_words = WORD_RE.findall(query_lower)
         
+        # One flag per record; each posting list is decoded and OR-ed in with vectorized calls
+        matched = np.zeros(len(search_index['all_records']), dtype=bool)
         for word in query_words:
             # Exact word matches
-            matching_indices.update(SEARCH_INDEX['by_filename'].get(word, []))
-            matching_indices.update(SEARCH_INDEX['by_content'].get(word, []))
-            matching_indices.update(SEARCH_INDEX['by_path'].get(word, []))
+            for key in ('by_filename', 'by_content', 'by_path'):
+                if word in search_index[key]:
+                    matched[decode_postings(search_index[key][word])] = True
             
             # Partial matches
-            for indexed_word in list(SEARCH_INDEX['by_filename'].keys()) + list(SEARCH_INDEX['by_content'].keys()):
-                if word in indexed_word or indexed_word in word:
-                    if word in indexed_word:
-                        matching_indices.update(SEARCH_INDEX['by_filename'].get(indexed_word, []))
-                        matching_indices.update(SEARCH_INDEX['by_content'].get(indexed_word, []))
+            for indexed_word in words_containing(search_index, word):
+                for key in ('by_filename', 'by_content'):
+                    if indexed_word in search_index[key]:
+                        matched[decode_postings(search_index[key][indexed_word])] = True
+        
+        # Only the records that will be returned are turned into Python ints
+        matching_indices = np.flatnonzero(matched)[:SEARCH_RESULT_LIMIT].tolist()
     
     elif search_type == "semantic":
-        # For semantic search, we'd use actual embeddings
-        # For now, implement as enhanced keyword search with similarity
+        # Sentence-transformers embeddings when installed; hash embeddings only match exact text
         query_embedding = generate_embeddings(query)
         
-        # Calculate similarity with all indexed documents
-        scored_results = []
-        for i, record in enumerate(SEARCH_INDEX['all_records']):
-            if record.get('embedding_vector'):
-                # Calculate cosine similarity (simplified)
-                doc_embedding = record['embedding_vector']
-                try:
-                    similarity = sum(a * b for a, b in zip(query_embedding, doc_embedding))
-                    similarity /= (sum(a * a for a in query_embedding) * sum(b * b for b in doc_embedding)) ** 0.5
-                    if similarity > 0.1:  # Threshold
-                        scored_results.append((i, similarity))
-                except:
-                    continue
+        query_norm = np.linalg.norm(query_embedding)
+        embeddings = search_index['embeddings']
+        if query_norm == 0 or len(embeddings) == 0:
+            return []
+        
+        # Cosine similarity with all indexed documents, dequantizing a block of rows per BLAS call
+        unit_query = (query_embedding / query_norm).astype(np.float32)
+        similarities = np.empty(len(embeddings), dtype=np.float32)
+        for start in range(0, len(embeddings), SIMILARITY_BLOCK_ROWS):
+            block = embeddings[start:start + SIMILARITY_BLOCK_ROWS]
+            similarities[start:start + len(block)] = block.astype(np.float32) @ unit_query
+        similarities *= search_index['embedding_scales']
+        candidates = np.flatnonzero(similarities > 0.1)  # Threshold
         
-        # Sort by similarity
-        scored_results.sort(key=lambda x: x[1], reverse=True)
-        matching_indices = [i for i, _ in scored_results[:20]]  # Top 20 results
+        # Top 20 results, best first
+        if len(candidates) > 20:
+            candidates = candidates[np.argpartition(-similarities[candidates], 20)[:20]]
+        candidates = candidates[np.argsort(-similarities[candidates], kind='stable')]
+        matching_indices = search_index['embedding_rows'][candidates].tolist()
     
     # Return matching records
     results = []
     for i in matching_indices:
-        if i < len(SEARCH_INDEX['all_records']):
-            record = SEARCH_INDEX['all_records'][i].copy()
+        if i < len(search_index['all_records']):
+            record = search_index['all_records'][i].copy()
             # Add relevance score for display
             record['relevance'] = 1.0  # Simplified scoring
             results.append(record)
     
-    return results[:50]  # Limit to 50 results
+    return results[:SEARCH_RESULT_LIMIT]
 
 if __name__ == "__main__":
     # Example usage
@@ -414,4 +1013,4 @@ if __name__ == "__main__":
     print(f"Found {len(results)} results for 'document'")
     
     for result in results[:3]:
-        print(f"- {result['filename']}: {result.get('text_content', '')[:100]}...")
\ No newline at end of file
+        print(f"- {result['filename']}: {result.get('snippet', '')[:100]}...")
\ No newline at end of file
@@ -0,0 +1,85 @@
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List
+from .scanner import identifier_parts
+
+# Keyword search runs against an FTS5 inverted index built at scan time
+FTS_DB_FILE = "smartfolder_fts.sqlite"
+FTS_SNIPPET_TOKENS = 16
+
+_CONNECTION = None
+_LOCK = threading.Lock()  # Endpoints run on FastAPI's threadpool and share one connection
+_QUERY_TERM_RE = re.compile(r"\w+")
+
+def _get_connection() -> sqlite3.Connection:
+    """Opens the full-text database on first use."""
+    global _CONNECTION
+    if _CONNECTION is None:
+        _CONNECTION = sqlite3.connect(FTS_DB_FILE, check_same_thread=False)
+        _CONNECTION.execute("PRAGMA journal_mode=WAL")
+        _CONNECTION.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5("
+            "filename, text_content, path, file_type UNINDEXED, size UNINDEXED, "
+            "identifier_parts, "  # searchContent -> "search content"; unicode61 doesn't split on case
+            "tokenize='porter unicode61')"
+        )
+    return _CONNECTION
+
+def build_fts(records: Iterable[Dict[str, Any]]):
+    """Replaces the full-text index with the given records in one transaction.
+
+    `records` may be a generator; rows are converted as they are inserted.
+    """
+    rows = (
+        (
+            record.get("filename", ""),
+            record.get("text_content") or "",
+            record.get("path", ""),
+            record.get("file_type", "unknown"),
+            record.get("size", 0),
+            " ".join(identifier_parts(record.get("filename", "")) |
+                     identifier_parts(record.get("text_content") or ""))
+        )
+        for record in records
+    )
+    with _LOCK:
+        conn = _get_connection()
+        with conn:
+            conn.execute("DELETE FROM docs")
+            conn.executemany(
+                "INSERT INTO docs (filename, text_content, path, file_type, size, identifier_parts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+def _match_expression(query: str) -> str:
+    """Turns free text into an FTS5 query matching any term as a prefix."""
+    return " OR ".join(f'"{term}"*' for term in _QUERY_TERM_RE.findall(query.lower()))
+
+def fts_search(query: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Returns the best-ranked records for a keyword query (BM25 order)."""
+    match = _match_expression(query)
+    if not match:
+        return []
+    with _LOCK:
+        rows = _get_connection().execute(
+            "SELECT path, filename, file_type, size, "
+            f"snippet(docs, 1, '', '', '…', {FTS_SNIPPET_TOKENS}), bm25(docs) "
+            "FROM docs WHERE docs MATCH ? ORDER BY bm25(docs) LIMIT ?",
+            (match, limit)
+        ).fetchall()
+
+    # bm25() is lower-is-better and unbounded; report relevance relative to the best hit
+    best = -rows[0][5] if rows else 0.0
+    return [
+        {
+            "path": path,
+            "filename": filename,
+            "file_type": file_type,
+            "size": size,
+            "snippet": snippet,
+            "relevance": -rank / best if best > 0 else 1.0
+        }
+        for path, filename, file_type, size, snippet, rank in rows
+    ]
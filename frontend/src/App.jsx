@@ -84,8 +84,18 @@ function App() {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ paths: selectedPaths })
       });
-      const data = await response.json();
+      let data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.detail || response.statusText);
+      }
       setScanStatus(data);
+      // The scan runs in the background; poll its job until it finishes
+      while (data.state === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobResponse = await fetch(`/api/scan/${data.job_id}`);
+        data = await jobResponse.json();
+        setScanStatus(data);
+      }
       // Refresh data after scan
       fetchFaceClusters();
       fetchSystemStatus();